@@ -6,25 +6,60 @@
 * https://w3c-ccg.github.io/did-method-web/
 * https://atproto.com/specs/handle#handle-resolution
 """
+import asyncio
 import base64
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+import functools
+import hashlib
+import http.cookiejar
 import json
 import logging
 import os
 import re
+import ssl
+import threading
 import urllib.parse
+import weakref
 
-from cachetools import cached, TTLCache
+from cachetools import cached, LRUCache, TTLCache
+from cachetools.keys import hashkey
 from cryptography.hazmat.primitives.asymmetric import ec
-from cryptography.hazmat.primitives.hashes import Hash, SHA256
 from cryptography.hazmat.primitives import serialization
-from dns.exception import DNSException
+from dns.exception import DNSException, Timeout as DNSTimeout
 from dns.rdatatype import TXT
+import dns.asyncresolver
 import dns.resolver
 import dag_cbor
-from multiformats import multibase, multicodec
+from multiformats import CID, multibase, multicodec, multihash
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import libipld
+except ImportError:
+    libipld = None
+
+try:
+    import cbrrr
+except ImportError:
+    cbrrr = None
+
+try:
+    import based58
+except ImportError:
+    based58 = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from . import util
 
@@ -38,14 +73,219 @@ DidPlc = namedtuple('DidPlc', [
 logger = logging.getLogger(__name__)
 
 CACHE_SIZE = 5000
+# default TTL, used when the response doesn't say how long to cache it for
 CACHE_TTL = timedelta(hours=6)
+MIN_CACHE_TTL = timedelta(minutes=1)
+MAX_CACHE_TTL = timedelta(hours=24)
+# how long past their TTL to keep serving cached values while they're refreshed
+# in the background
+CACHE_STALE_TTL = timedelta(hours=1)
+REFRESH_THREADS = 10
+HANDLE_THREADS = 20
+# defaults for how long to wait for each DNS server and for a whole DNS query,
+# including retries. override with the ARROBA_DNS_TIMEOUT and
+# ARROBA_DNS_LIFETIME environment variables, in seconds.
+DNS_TIMEOUT = timedelta(seconds=1)
+DNS_LIFETIME = timedelta(seconds=2)
+DID_KEY_CACHE_SIZE = 4096
+# how long to trust the last PLC operation we wrote for a DID as its head
+PLC_HEAD_CACHE_TTL = timedelta(minutes=5)
+
+MAX_AGE_RE = re.compile(r'max-age=(\d+)')
 
 # from https://atproto.com/specs/handle#handle-identifier-syntax
 HANDLE_RE = re.compile(
     r'^([a-zA-Z0-9]([a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]([a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?$')
 
-# used as get_fn below. wrap so that we can mock requests.get in tests
-requests_get = lambda *args, **kwargs: requests.get(*args, **kwargs)
+# DAG-CBOR encoder for PLC operations. prefer the native libipld or cbrrr
+# encoders when they're installed, they're much faster than dag_cbor.
+if libipld:
+    _encode_dag_cbor = libipld.encode_dag_cbor
+elif cbrrr:
+    _encode_dag_cbor = cbrrr.encode_dag_cbor
+else:
+    _encode_dag_cbor = dag_cbor.encode
+
+# JSON parser for DID documents. orjson is much faster than the stdlib when
+# it's installed.
+_parse_json = orjson.loads if orjson else json.loads
+
+# DAG-CBOR encoded 'sig' map key, used in _encode_signed_op
+_SIG_KEY_CBOR = _encode_dag_cbor('sig')
+
+# shared by all HTTPS connections so that we only load CA certs once per
+# process. uses the same CA bundle as requests.
+_ssl_context = ssl.create_default_context(cafile=requests.certs.where())
+
+
+class _SSLContextAdapter(HTTPAdapter):
+    """HTTP adapter that uses :data:`_ssl_context` for all connection pools."""
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = _ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def cert_verify(self, conn, url, verify, cert):
+        super().cert_verify(conn, url, verify, cert)
+        if verify is True:
+            # _ssl_context already has requests's CA bundle loaded. if these are
+            # set, urllib3 loads the bundle into it again on every new connection.
+            conn.ca_certs = conn.ca_cert_dir = None
+
+
+# shared across resolves so that we reuse connections, and their TLS sessions,
+# to the PLC directory and other hosts. these hosts are arbitrary DID and handle
+# domains, so don't store or send back any cookies they set.
+session = requests.Session()
+session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+session.mount('https://', _SSLContextAdapter(pool_connections=32, pool_maxsize=64))
+
+# used as get_fn below. wrap so that we can mock requests.Session.get in tests
+requests_get = lambda *args, **kwargs: session.get(*args, **kwargs)
+
+# used by _resolve_async. in flight fetches are bound to the event loop they
+# were started in, so we keep them per loop.
+_async_inflight = weakref.WeakKeyDictionary()
+
+# used by _get_async. httpx clients are also bound to the event loop they're
+# first used in, so we keep one per loop, in this attribute on the loop itself.
+# anything outside the loop that held the client would keep the loop alive,
+# since the client's connections, and the async generator that closes it, both
+# refer back to the loop. value is a (client, closer async generator) tuple.
+_ASYNC_CLIENT_ATTR = '_arroba_httpx_client'
+
+# maps did:plc to the last operation we wrote for it, in the same shape as PLC
+# directory audit log entries, with cid and operation.alsoKnownAs. used by
+# update_plc so that back to back updates don't need to re-fetch the head.
+_plc_heads = TTLCache(maxsize=CACHE_SIZE, ttl=PLC_HEAD_CACHE_TTL.total_seconds())
+_plc_heads_lock = threading.Lock()
+
+# shared by the sync and asyncio DNS resolvers
+_dns_cache = dns.resolver.LRUCache(max_size=CACHE_SIZE)
+
+# runs background refreshes of stale cached values in _cached_with_ttl
+_refresh_executor = ThreadPoolExecutor(max_workers=REFRESH_THREADS,
+                                       thread_name_prefix='did-refresh')
+
+# runs resolve_handle's DNS and HTTPS lookups concurrently. separate from
+# _refresh_executor since resolve_handle itself may run in a background refresh.
+_handle_executor = ThreadPoolExecutor(max_workers=HANDLE_THREADS,
+                                      thread_name_prefix='did-handle')
+
+
+@functools.cache
+def _plc_base():
+    """Returns the PLC directory's base URL, from the ``PLC_HOST`` env var.
+
+    Cached, so changes to ``PLC_HOST`` after the first call are ignored until
+    ``_plc_base.cache_clear()`` is called.
+    """
+    return f'https://{os.environ["PLC_HOST"]}'
+
+
+@functools.cache
+def _pds_base():
+    """Returns this PDS's base URL, from the ``PDS_HOST`` env var.
+
+    Cached, so changes to ``PDS_HOST`` after the first call are ignored until
+    ``_pds_base.cache_clear()`` is called.
+    """
+    return f'https://{os.environ["PDS_HOST"]}'
+
+
+def _cached_with_ttl(fn):
+    """Decorator that caches a resolver's results, each with its own TTL.
+
+    The decorated function should return a ``(value, ttl)`` tuple, where ``ttl``
+    is how long to cache ``value`` for as a :class:`datetime.timedelta`, or None
+    to use :const:`CACHE_TTL`. TTLs are clamped to :const:`MIN_CACHE_TTL` and
+    :const:`MAX_CACHE_TTL`. The wrapped function returns just ``value``.
+
+    After a value's TTL expires, it's still served for up to
+    :const:`CACHE_STALE_TTL` more while it's refreshed in the background, at
+    most one refresh per key at a time.
+
+    Like :func:`cachetools.cached`, the cache is available as the wrapped
+    function's ``cache`` attribute. In-flight refreshes are in ``refreshes``, a
+    dict mapping cache key to :class:`concurrent.futures.Future`.
+
+    The asyncio resolvers share the cache via the wrapped function's
+    ``lookup(key, args, kwargs)`` and ``store(key, value, ttl)`` attributes.
+    ``lookup`` returns a ``(found, value)`` tuple.
+    """
+    cache = LRUCache(maxsize=CACHE_SIZE)
+    refreshes = {}
+    lock = threading.Lock()
+
+    def store(key, value, ttl, now=None):
+        if now is None:
+            now = util.time_ns()
+        if ttl is None:
+            ttl = CACHE_TTL
+        ttl = min(max(ttl, MIN_CACHE_TTL), MAX_CACHE_TTL)
+        fresh_until = now + int(ttl.total_seconds() * 1e9)
+        stale_until = fresh_until + int(CACHE_STALE_TTL.total_seconds() * 1e9)
+        with lock:
+            cache[key] = (value, fresh_until, stale_until)
+
+    def call_and_store(key, args, kwargs):
+        now = util.time_ns()
+        value, ttl = fn(*args, **kwargs)
+        store(key, value, ttl, now=now)
+        return value
+
+    def refresh(key, args, kwargs):
+        try:
+            call_and_store(key, args, kwargs)
+        except Exception as e:
+            logger.info(f'Background refresh of {fn.__name__}{args} failed: {e}')
+        finally:
+            with lock:
+                refreshes.pop(key, None)
+
+    def lookup(key, args, kwargs):
+        now = util.time_ns()
+
+        with lock:
+            cached = cache.get(key)
+            if cached:
+                value, fresh_until, stale_until = cached
+                if now < fresh_until:
+                    return True, value
+                elif now < stale_until:
+                    if key not in refreshes:
+                        refreshes[key] = _refresh_executor.submit(
+                            refresh, key, args, kwargs)
+                    return True, value
+
+        return False, None
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = hashkey(*args, **kwargs)
+        found, value = lookup(key, args, kwargs)
+        if found:
+            return value
+
+        return call_and_store(key, args, kwargs)
+
+    wrapper.cache = cache
+    wrapper.refreshes = refreshes
+    wrapper.lookup = lookup
+    wrapper.store = store
+    return wrapper
+
+
+def _max_age(resp):
+    """Returns an HTTP response's ``Cache-Control`` ``max-age``, if any.
+
+    Args:
+      resp (requests.Response)
+
+    Returns:
+      datetime.timedelta or None:
+    """
+    if match := MAX_AGE_RE.search(resp.headers.get('Cache-Control', '')):
+        return timedelta(seconds=int(match.group(1)))
 
 
 def resolve(did, **kwargs):
@@ -62,16 +302,13 @@ def resolve(did, **kwargs):
       ValueError: if the input is not a ``did:plc`` or ``did:web``
       requests.RequestException: if an HTTP request fails
     """
-    if did:
-        if did.startswith('did:plc:'):
-            return resolve_plc(did, **kwargs)
-        elif did.startswith('did:web:'):
-            return resolve_web(did, **kwargs)
+    if isinstance(did, str) and (fn := _RESOLVERS.get(did[:8])):
+        return fn(did, **kwargs)
 
     raise ValueError(f'{did} is not a did:plc or did:web')
 
 
-@cached(TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL.total_seconds()))
+@_cached_with_ttl
 def resolve_plc(did, get_fn=requests_get):
     """Resolves a ``did:plc`` by fetching its DID document from a PLC directory.
 
@@ -83,6 +320,9 @@ def resolve_plc(did, get_fn=requests_get):
     * https://atproto.com/specs/did-plc
     * https://github.com/bluesky-social/did-method-plc
 
+    Results are cached for the response's ``Cache-Control`` ``max-age``, or
+    :const:`CACHE_TTL` if it doesn't have one.
+
     Args:
       did (str)
       get_fn (callable): for making HTTP GET requests
@@ -97,9 +337,50 @@ def resolve_plc(did, get_fn=requests_get):
     if not isinstance(did, str) or not did.startswith('did:plc:'):
         raise ValueError(f'{did} is not a did:plc')
 
-    resp = get_fn(f'https://{os.environ["PLC_HOST"]}/{did}')
+    resp = get_fn(f'{_plc_base()}/{did}')
     resp.raise_for_status()
-    return resp.json()
+    return _parse_json(resp.content), _max_age(resp)
+
+
+def resolve_plc_many(dids, get_fn=requests_get, max_workers=16,
+                     raise_on_error=False):
+    """Resolves multiple ``did:plc``s concurrently.
+
+    Uses :func:`resolve_plc`, and its cache, in a thread pool. Duplicate DIDs
+    are only resolved once.
+
+    Args:
+      dids (iterable of str)
+      get_fn (callable): for making HTTP GET requests
+      max_workers (int): maximum number of concurrent resolves
+      raise_on_error (bool): whether to raise the first exception from
+        :func:`resolve_plc`. If False, DIDs that fail to resolve are logged and
+        omitted from the result.
+
+    Returns:
+      dict: maps str DID to dict JSON DID document
+
+    Raises:
+      ValueError: if ``raise_on_error`` is True and an input is not a ``did:plc``
+      requests.RequestException: if ``raise_on_error`` is True and an HTTP
+        request fails
+    """
+    dids = list(dict.fromkeys(dids))
+    docs = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers,
+                            thread_name_prefix='did-resolve-many') as executor:
+        futures = {did: executor.submit(resolve_plc, did, get_fn=get_fn)
+                   for did in dids}
+        for did, future in futures.items():
+            try:
+                docs[did] = future.result()
+            except (ValueError, requests.RequestException) as e:
+                if raise_on_error:
+                    raise
+                logger.info(f"Couldn't resolve {did}: {e}")
+
+    return docs
 
 
 def create_plc(handle, **kwargs):
@@ -120,20 +401,55 @@ def update_plc(did, **kwargs):
     assert 'rotation_key' in kwargs
     assert 'signing_key' in kwargs
 
-    # get CID of previous head operation for this DID from the directory
+    # get CID of previous head operation for this DID. use the one we wrote
+    # last if we have it, otherwise fetch it from the directory.
+    with _plc_heads_lock:
+        cached_op = _plc_heads.get(did)
+
+    if cached_op:
+        try:
+            return _update_plc_from(did, cached_op, **kwargs)
+        except requests.RequestException as e:
+            # our cached head may be stale, eg if another process or someone
+            # else updated this DID. evict it either way.
+            with _plc_heads_lock:
+                _plc_heads.pop(did, None)
+
+            # only retry if the directory rejected our update. after a timeout,
+            # connection error, or 5xx, it may have accepted it, and retrying
+            # would publish a second operation on top of it.
+            status = getattr(e.response, 'status_code', None)
+            if not (isinstance(e, requests.HTTPError) and status
+                    and 400 <= status < 500):
+                raise
+
+            logger.info(f'Updating {did} on cached head failed, retrying: {e}')
+
     # response is a JSON list with operations from earliest to latest
     # https://github.com/did-method-plc/did-method-plc#audit-logs
     get_fn = kwargs.get('get_fn') or requests_get
-    resp = get_fn(f'https://{os.environ["PLC_HOST"]}/{did}/log/audit')
-    last_op = resp.json()[-1]
+    resp = get_fn(f'{_plc_base()}/{did}/log/audit')
+    return _update_plc_from(did, resp.json()[-1], **kwargs)
+
+
+def _update_plc_from(did, last_op, **kwargs):
+    """Writes a PLC update operation on top of a given previous operation.
 
+    Args:
+      did (str)
+      last_op (dict): previous operation, in PLC directory audit log format
+      kwargs: passed through to :func:`write_plc`
+
+    Returns:
+      DidPlc:
+    """
     # merge new data into existing data
-    handle = last_op['operation']['alsoKnownAs'].pop(0)
+    handle, *also_known_as = last_op['operation']['alsoKnownAs']
     assert handle.startswith('at://')
     handle = handle.removeprefix('at://')
     kwargs.setdefault('handle', handle)
 
-    kwargs.setdefault('also_known_as', last_op['operation']['alsoKnownAs'])
+    kwargs.setdefault('also_known_as', also_known_as)
 
     # write update operation
     return write_plc(did=did, prev=last_op['cid'], **kwargs)
@@ -181,13 +497,11 @@ def write_plc(did=None, handle=None, signing_key=None, rotation_key=None,
       ValueError: if any inputs are invalid
       requests.RequestException: if the HTTP request to the PLC directory fails
     """
-    plc_host = os.environ['PLC_HOST']
-
     if not isinstance(handle, str) or not handle:
         raise ValueError(f'{handle} is not a valid handle')
 
     if not pds_url:
-        pds_url = f'https://{os.environ["PDS_HOST"]}'
+        pds_url = _pds_base()
 
     for key in signing_key, rotation_key:
         if key and not isinstance(key.curve, ec.SECP256K1):
@@ -201,10 +515,12 @@ def write_plc(did=None, handle=None, signing_key=None, rotation_key=None,
         logger.info('Generating new k256 rotation key')
         rotation_key = util.new_key()
 
-    if not also_known_as:
-        also_known_as = []
-    elif isinstance(also_known_as, str):
-        also_known_as = [also_known_as]
+    aka = [f'at://{handle}']
+    if also_known_as:
+        if isinstance(also_known_as, str):
+            aka.append(also_known_as)
+        else:
+            aka.extend(also_known_as)
 
     logger.info('Generating and signing PLC directory operation...')
     # this is a PLC directory genesis operation for creating or updating a DID.
@@ -216,7 +532,7 @@ def write_plc(did=None, handle=None, signing_key=None, rotation_key=None,
         'verificationMethods': {
             'atproto': encode_did_key(signing_key.public_key()),
         },
-        'alsoKnownAs': [f'at://{handle}'] + list(also_known_as),
+        'alsoKnownAs': aka,
         'services': {
             'atproto_pds': {
                 'type': 'AtprotoPersonalDataServer',
@@ -225,36 +541,93 @@ def write_plc(did=None, handle=None, signing_key=None, rotation_key=None,
         },
         'prev': prev,
     }
-    op = util.sign(op, rotation_key)
-    op['sig'] = base64.urlsafe_b64encode(op['sig']).decode().rstrip('=')
+    unsigned = _encode_dag_cbor(op)
+    sig = util.sign_encoded(unsigned, rotation_key)
+    op['sig'] = base64.urlsafe_b64encode(sig).rstrip(b'=').decode()
+
+    hash = hashlib.sha256(_encode_signed_op(unsigned, op['sig'])).digest()
 
     if did:
         logger.info(f'Updating existing DID {did}')
     else:
-        sha256 = Hash(SHA256())
-        sha256.update(dag_cbor.encode(op))
-        hash = sha256.finalize()
-        did = 'did:plc:' + base64.b32encode(hash)[:24].lower().decode()
+        # the DID is the first 24 base32 chars of the hash, which encode
+        # exactly its first 15 bytes
+        did = 'did:plc:' + base64.b32encode(hash[:15]).decode().lower()
         logger.info(f'Creating new DID {did}')
 
-    plc_url = f'https://{plc_host}/{did}'
+    plc_url = f'{_plc_base()}/{did}'
     logger.info(f'Publishing to {plc_url}  ...')
-    resp = post_fn(plc_url, json=op)
+    body = json.dumps(op, separators=(',', ':')).encode()
+    resp = post_fn(plc_url, data=body, headers={'Content-Type': 'application/json'})
     logger.info(f'{resp} {resp.content}')
     resp.raise_for_status()
 
+    # remember this operation as the DID's head for update_plc
+    cid = CID('base32', 1, 'dag-cbor', multihash.wrap(hash, 'sha2-256'))
+    with _plc_heads_lock:
+        _plc_heads[did] = {
+            'cid': cid.encode('base32'),
+            'operation': {'alsoKnownAs': aka},
+        }
+
     op['did'] = did
     return DidPlc(did=did, doc=plc_operation_to_did_doc(op),
                   signing_key=signing_key, rotation_key=rotation_key)
 
 
+def _encode_signed_op(unsigned, sig):
+    """Adds a ``sig`` field to an already DAG-CBOR encoded PLC operation.
+
+    DAG-CBOR sorts map keys by length first, and ``sig`` is shorter than every
+    other PLC operation key, so it always comes first. That lets us splice it in
+    right after the map header instead of encoding the whole operation again.
+
+    Args:
+      unsigned (bytes): DAG-CBOR encoded PLC operation, without ``sig``. Must be
+        a map with fewer than 23 keys, so that its header is a single byte.
+      sig (str): encoded signature
+
+    Returns:
+      bytes: the same value as ``dag_cbor.encode({**op, 'sig': sig})``
+    """
+    header = unsigned[0]
+    assert 0xa0 <= header < 0xb7, header
+    return (bytes((header + 1,)) + _SIG_KEY_CBOR + _encode_dag_cbor(sig)
+            + unsigned[1:])
+
+
+class CompressedPublicKey(bytes):
+    """A raw compressed elliptic curve public key point.
+
+    Decoding a point into an :class:`ec.EllipticCurvePublicKey` decompresses and
+    validates it, which is expensive. Callers that only compare or re-encode a
+    key can use this instead, and convert it with :meth:`to_cryptography` only
+    when they actually need to verify a signature.
+
+    Attributes:
+      curve (ec.EllipticCurve)
+    """
+    def __new__(cls, data, curve):
+        key = super().__new__(cls, data)
+        key.curve = curve
+        return key
+
+    def to_cryptography(self):
+        """Decompresses and validates this point.
+
+        Returns:
+          ec.EllipticCurvePublicKey
+        """
+        return ec.EllipticCurvePublicKey.from_encoded_point(self.curve, bytes(self))
+
+
 def encode_did_key(pubkey):
-    """Encodes an :class:`ec.EllipticCurvePublicKey` into a ``did:key`` string.
+    """Encodes a public key into a ``did:key`` string.
 
     https://atproto.com/specs/did#public-key-encoding
 
     Args:
-      pubkey (ec.EllipticCurvePublicKey)
+      pubkey (ec.EllipticCurvePublicKey or CompressedPublicKey)
 
     Returns:
       str: encoded ``did:key``
@@ -266,11 +639,45 @@ def encode_did_key(pubkey):
     else:
         raise ValueError(f'Expected secp256k1 or secp256r1 curve, got {pubkey.curve}')
 
-    pubkey_bytes = pubkey.public_bytes(serialization.Encoding.X962,
-                                       serialization.PublicFormat.CompressedPoint)
-    pubkey_multibase = multibase.encode(multicodec.wrap(codec, pubkey_bytes),
-                                        'base58btc')
-    return f'did:key:{pubkey_multibase}'
+    if isinstance(pubkey, CompressedPublicKey):
+        pubkey_bytes = bytes(pubkey)
+    else:
+        pubkey_bytes = pubkey.public_bytes(serialization.Encoding.X962,
+                                           serialization.PublicFormat.CompressedPoint)
+    return _encode_compressed(codec, pubkey_bytes)
+
+
+@cached(LRUCache(maxsize=DID_KEY_CACHE_SIZE), lock=threading.Lock())
+def _encode_compressed(codec, pubkey_bytes):
+    """Encodes a compressed public key point into a ``did:key`` string.
+
+    Args:
+      codec (str): multicodec name, eg ``secp256k1-pub``
+      pubkey_bytes (bytes): compressed point
+
+    Returns:
+      str: encoded ``did:key``
+    """
+    wrapped = multicodec.wrap(codec, pubkey_bytes)
+    return f'did:key:{_multibase_base58btc(wrapped)}'
+
+
+def _multibase_base58btc(data):
+    """Multibase encodes bytes with base58btc.
+
+    Uses the native based58 encoder if it's installed, otherwise multiformats'
+    pure Python encoder.
+
+    Args:
+      data (bytes)
+
+    Returns:
+      str: multibase-encoded, including the ``z`` prefix
+    """
+    if based58:
+        return 'z' + based58.b58encode(data).decode()
+
+    return multibase.encode(data, 'base58btc')
 
 
 def decode_did_key(did_key):
@@ -284,6 +691,22 @@ def decode_did_key(did_key):
     Returns:
       ec.EllipticCurvePublicKey
     """
+    return decode_did_key_compressed(did_key).to_cryptography()
+
+
+def decode_did_key_compressed(did_key):
+    """Decodes a ``did:key`` string into a :class:`CompressedPublicKey`.
+
+    Unlike :func:`decode_did_key`, doesn't decompress or validate the point.
+
+    https://atproto.com/specs/did#public-key-encoding
+
+    Args:
+      did_key (str)
+
+    Returns:
+      CompressedPublicKey
+    """
     wrapped_bytes = multibase.decode(did_key.removeprefix('did:key:'))
     codec, data = multicodec.unwrap(wrapped_bytes)
 
@@ -294,7 +717,7 @@ def decode_did_key(did_key):
     else:
         raise ValueError(f'Expected secp256k1 or secp256r1 curve, got {codec.name}')
 
-    return ec.EllipticCurvePublicKey.from_encoded_point(curve, data)
+    return CompressedPublicKey(data, curve)
 
 
 def plc_operation_to_did_doc(op):
@@ -338,12 +761,15 @@ def plc_operation_to_did_doc(op):
     }
 
 
-@cached(TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL.total_seconds()))
+@_cached_with_ttl
 def resolve_web(did, get_fn=requests_get):
     """Resolves a ``did:web`` by fetching its DID document.
 
     ``did:web`` spec: https://w3c-ccg.github.io/did-method-web/
 
+    Results are cached for the response's ``Cache-Control`` ``max-age``, or
+    :const:`CACHE_TTL` if it doesn't have one.
+
     Args:
       did (str)
       get_fn (callable): for making HTTP GET requests
@@ -355,6 +781,23 @@ def resolve_web(did, get_fn=requests_get):
       ValueError: if the input did is not a ``did:web`` str
       requests.RequestException: if the HTTP request fails
     """
+    resp = get_fn(_did_web_url(did))
+    resp.raise_for_status()
+    return _parse_json(resp.content), _max_age(resp)
+
+
+def _did_web_url(did):
+    """Returns the URL of a ``did:web``'s DID document.
+
+    Args:
+      did (str)
+
+    Returns:
+      str: URL
+
+    Raises:
+      ValueError: if the input did is not a ``did:web`` str
+    """
     if not isinstance(did, str) or not did.startswith('did:web:'):
         raise ValueError(f'{did} is not a did:web')
 
@@ -364,19 +807,158 @@ def resolve_web(did, get_fn=requests_get):
     else:
         did += '/.well-known'
 
-    resp = get_fn(f'https://{urllib.parse.unquote(did)}/did.json')
-    resp.raise_for_status()
-    return resp.json()
+    return f'https://{urllib.parse.unquote(did)}/did.json'
+
 
+async def resolve_plc_async(did):
+    """Resolves a ``did:plc``, asynchronously.
+
+    Same as :func:`resolve_plc`, and shares its cache. Uses httpx if it's
+    installed, otherwise runs the HTTP request in a thread. Concurrent calls
+    for the same DID share a single request.
+
+    Args:
+      did (str)
 
-@cached(TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL.total_seconds()))
+    Returns:
+      dict: JSON DID document
+
+    Raises:
+      ValueError: if the input did is not a ``did:plc`` str
+      requests.RequestException or httpx.HTTPError: if the HTTP request fails
+    """
+    if not isinstance(did, str) or not did.startswith('did:plc:'):
+        raise ValueError(f'{did} is not a did:plc')
+
+    return await _resolve_async(resolve_plc, did, f'{_plc_base()}/{did}')
+
+
+async def resolve_web_async(did):
+    """Resolves a ``did:web``, asynchronously.
+
+    Same as :func:`resolve_web`, and shares its cache. Uses httpx if it's
+    installed, otherwise runs the HTTP request in a thread. Concurrent calls
+    for the same DID share a single request.
+
+    Args:
+      did (str)
+
+    Returns:
+      dict: JSON DID document
+
+    Raises:
+      ValueError: if the input did is not a ``did:web`` str
+      requests.RequestException or httpx.HTTPError: if the HTTP request fails
+    """
+    return await _resolve_async(resolve_web, did, _did_web_url(did))
+
+
+async def _resolve_async(resolver, did, url):
+    """Fetches a DID document asynchronously, using a resolver's cache.
+
+    Args:
+      resolver (callable): :func:`resolve_plc` or :func:`resolve_web`
+      did (str)
+      url (str): DID document URL
+
+    Returns:
+      dict: JSON DID document
+    """
+    key = hashkey(did)
+    found, doc = resolver.lookup(key, (did,), {})
+    if found:
+        return doc
+
+    inflight = _async_inflight.setdefault(asyncio.get_running_loop(), {})
+    inflight_key = (resolver.__name__, did)
+    if not (task := inflight.get(inflight_key)):
+        async def fetch():
+            try:
+                resp = await _get_async(url)
+                resp.raise_for_status()
+                doc = _parse_json(resp.content)
+                resolver.store(key, doc, _max_age(resp))
+                return doc
+            finally:
+                inflight.pop(inflight_key, None)
+
+        task = inflight[inflight_key] = asyncio.ensure_future(fetch())
+
+    # other callers may be waiting on the same task, so don't let this caller
+    # being cancelled cancel it
+    return await asyncio.shield(task)
+
+
+async def _get_async(url):
+    """Makes an HTTP GET request asynchronously.
+
+    Uses a shared :class:`httpx.AsyncClient` per event loop if httpx is
+    installed, otherwise runs :func:`requests_get` in a thread.
+
+    Args:
+      url (str)
+
+    Returns:
+      httpx.Response or requests.Response
+    """
+    if not httpx:
+        return await asyncio.to_thread(requests_get, url)
+
+    loop = asyncio.get_running_loop()
+    if found := getattr(loop, _ASYNC_CLIENT_ATTR, None):
+        client, _ = found
+    else:
+        client = httpx.AsyncClient(
+            http2=True, limits=httpx.Limits(max_connections=256))
+        closer = _close_on_shutdown(weakref.ref(loop), client)
+        setattr(loop, _ASYNC_CLIENT_ATTR, (client, closer))
+        await closer.asend(None)
+
+    return await client.get(url)
+
+
+async def _close_on_shutdown(loop_ref, client):
+    """Closes an httpx client when its event loop shuts down.
+
+    Event loops close their live async generators in
+    :meth:`asyncio.loop.shutdown_asyncgens`, eg at the end of
+    :func:`asyncio.run`, while they're still running, so this can await
+    ``aclose``. Loops that are closed without that, eg after
+    ``run_until_complete``, just drop the client when they're garbage
+    collected.
+
+    Args:
+      loop_ref (weakref.ref): to the client's :class:`asyncio.AbstractEventLoop`
+      client (httpx.AsyncClient)
+    """
+    try:
+        yield
+    finally:
+        if (loop := loop_ref()) is not None:
+            loop.__dict__.pop(_ASYNC_CLIENT_ATTR, None)
+        await client.aclose()
+
+
+# used by resolve, keyed by DID prefix
+_RESOLVERS = {
+    'did:plc:': resolve_plc,
+    'did:web:': resolve_web,
+}
+
+
+@_cached_with_ttl
 def resolve_handle(handle, get_fn=requests_get):
     """Resolves an ATProto handle to a DID.
 
-    Supports the DNS TXT record and HTTPS well-known methods.
+    Supports the DNS TXT record and HTTPS well-known methods. Runs both
+    concurrently, so it usually makes the HTTPS request even when DNS finds a
+    DID, but the DNS result takes precedence.
 
     https://atproto.com/specs/handle#handle-resolution
 
+    Results are cached for the DNS record's TTL or the HTTPS response's
+    ``Cache-Control`` ``max-age``, or :const:`CACHE_TTL` if neither is available.
+
     Args:
       handle (str)
       get_fn (callable): for making HTTP GET requests
@@ -387,36 +969,226 @@ def resolve_handle(handle, get_fn=requests_get):
     Raises:
       ValueError: if handle is not a domain
     """
-    if not handle or not isinstance(handle, str) or not util.DOMAIN_RE.match(handle):
+    if not _prefilter_handle(handle) or not util.DOMAIN_RE.fullmatch(handle):
         raise ValueError(f"{handle} doesn't look like a domain")
 
     logger.info(f'Resolving handle {handle}')
 
-    # DNS method
+    # run both methods concurrently, but DNS takes precedence, so only use
+    # HTTPS if DNS doesn't find a DID
+    dns_future = _handle_executor.submit(_resolve_handle_dns, handle)
+    https_future = _handle_executor.submit(_resolve_handle_https, handle, get_fn)
+
+    did, ttl = dns_future.result()
+    if did:
+        https_future.cancel()
+        return did, ttl
+
+    did, https_ttl = https_future.result()
+    if did or ttl is None:
+        ttl = https_ttl
+    return did, ttl
+
+
+async def resolve_handle_async(handle, get_fn=requests_get):
+    """Resolves an ATProto handle to a DID, asynchronously.
+
+    Same as :func:`resolve_handle`, and shares its cache, except it uses
+    dnspython's asyncio resolver for DNS and runs the HTTPS well-known method in
+    a thread.
+
+    Args:
+      handle (str)
+      get_fn (callable): for making HTTP GET requests
+
+    Returns:
+      str or None: DID, or None if the handle can't be resolved
+
+    Raises:
+      ValueError: if handle is not a domain
+    """
+    if not _prefilter_handle(handle) or not util.DOMAIN_RE.fullmatch(handle):
+        raise ValueError(f"{handle} doesn't look like a domain")
+
+    # match resolve_handle's cache keys
+    kwargs = {} if get_fn is requests_get else {'get_fn': get_fn}
+    key = hashkey(handle, **kwargs)
+    found, did = resolve_handle.lookup(key, (handle,), kwargs)
+    if found:
+        return did
+
+    logger.info(f'Resolving handle {handle}')
+
+    # same as resolve_handle, DNS takes precedence
+    https_task = asyncio.ensure_future(
+        asyncio.to_thread(_resolve_handle_https, handle, get_fn))
+    try:
+        did, ttl = await _resolve_handle_dns_async(handle)
+    except BaseException:
+        https_task.cancel()
+        raise
+
+    if did:
+        https_task.cancel()
+    else:
+        did, https_ttl = await https_task
+        if did or ttl is None:
+            ttl = https_ttl
+
+    resolve_handle.store(key, did, ttl)
+    return did
+
+
+@functools.cache
+def _dns_resolver():
+    """Returns the shared DNS resolver for handle resolution.
+
+    Created lazily since it reads the system's DNS configuration.
+
+    Returns:
+      dns.resolver.Resolver
+    """
+    return _configure_dns_resolver(dns.resolver.Resolver())
+
+
+@functools.cache
+def _dns_resolver_async():
+    """Returns the shared asyncio DNS resolver for handle resolution.
+
+    Returns:
+      dns.asyncresolver.Resolver
+    """
+    return _configure_dns_resolver(dns.asyncresolver.Resolver())
+
+
+def _configure_dns_resolver(resolver):
+    """Sets up a new DNS resolver with our shared cache and timeouts.
+
+    Args:
+      resolver (dns.resolver.Resolver or dns.asyncresolver.Resolver)
+
+    Returns:
+      the same resolver
+    """
+    resolver.cache = _dns_cache
+    resolver.timeout = float(os.getenv('ARROBA_DNS_TIMEOUT',
+                                       DNS_TIMEOUT.total_seconds()))
+    resolver.lifetime = float(os.getenv('ARROBA_DNS_LIFETIME',
+                                        DNS_LIFETIME.total_seconds()))
+    return resolver
+
+
+def _resolve_handle_dns(handle):
+    """Resolves an ATProto handle to a DID with the DNS TXT record method.
+
+    Args:
+      handle (str)
+
+    Returns:
+      (str, datetime.timedelta) tuple: DID and the TXT record's TTL, or
+      ``(None, None)`` if the handle can't be resolved
+    """
+    name = f'_atproto.{handle}.'
+    try:
+        logger.info(f'Querying DNS TXT for {name}')
+        try:
+            answer = _dns_resolver().resolve(name, TXT)
+        except DNSTimeout as e:
+            logger.info(f'{e!r}, retrying over TCP')
+            answer = _dns_resolver().resolve(name, TXT, tcp=True)
+        return _did_from_dns_answer(name, answer)
+    except DNSException as e:
+        logger.info(repr(e))
+
+    return None, None
+
+
+async def _resolve_handle_dns_async(handle):
+    """Asyncio version of :func:`_resolve_handle_dns`."""
     name = f'_atproto.{handle}.'
     try:
         logger.info(f'Querying DNS TXT for {name}')
-        answer = dns.resolver.resolve(name, TXT)
-        logger.info(f'Got: {answer.response}')
-        if answer.canonical_name.to_text() == name:
-            for rdata in answer:
-                if rdata.rdtype == TXT:
-                    text = rdata.to_text()
-                    if text.startswith('"did=did:'):
-                        return text.strip('"').removeprefix('did=')
+        try:
+            answer = await _dns_resolver_async().resolve(name, TXT)
+        except DNSTimeout as e:
+            logger.info(f'{e!r}, retrying over TCP')
+            answer = await _dns_resolver_async().resolve(name, TXT, tcp=True)
+        return _did_from_dns_answer(name, answer)
     except DNSException as e:
         logger.info(repr(e))
 
-    # HTTPS well-known method
+    return None, None
+
+
+def _did_from_dns_answer(name, answer):
+    """Extracts an ATProto handle's DID from its DNS TXT record answer.
+
+    Args:
+      name (str): the name that was queried, eg ``_atproto.foo.com.``
+      answer (dns.resolver.Answer)
+
+    Returns:
+      (str, datetime.timedelta) tuple: DID and the TXT record's TTL, or
+      ``(None, None)`` if the answer doesn't have a DID
+    """
+    logger.info(f'Got: {answer.response}')
+    if answer.canonical_name.to_text() == name:
+        for rdata in answer:
+            if rdata.rdtype == TXT:
+                # long TXT values may be split into multiple strings
+                value = b''.join(rdata.strings)
+                if value.startswith(b'did=did:'):
+                    # TXT records are arbitrary bytes. DIDs are ASCII.
+                    try:
+                        did = value[4:].decode('ascii')
+                    except UnicodeDecodeError:
+                        logger.info(f'Skipping non-ASCII TXT record {value!r}')
+                        continue
+                    return did, timedelta(seconds=answer.rrset.ttl)
+
+    return None, None
+
+
+def _prefilter_handle(handle):
+    """Cheap checks that rule out obviously invalid handles before DOMAIN_RE.
+
+    Only rejects handles that can't be resolvable domains: too short, longer
+    than DNS's 253 character limit, no dot, or an empty label (``..``).
+    Everything else is left to :attr:`util.DOMAIN_RE`.
+
+    Args:
+      handle (str)
+
+    Returns:
+      bool: False if ``handle`` is definitely invalid, True if it may be valid
+    """
+    return (isinstance(handle, str)
+            and 3 <= len(handle) <= 253
+            and '.' in handle
+            and '..' not in handle)
+
+
+def _resolve_handle_https(handle, get_fn):
+    """Resolves an ATProto handle to a DID with the HTTPS well-known method.
+
+    Args:
+      handle (str)
+      get_fn (callable): for making HTTP GET requests
+
+    Returns:
+      (str, datetime.timedelta) tuple: DID and the response's ``max-age``. The
+      DID is None if the handle can't be resolved. ``max-age`` is None if the
+      response doesn't have one.
+    """
     try:
         resp = get_fn(f'https://{handle}/.well-known/atproto-did')
     except requests.RequestException as e:
         logger.info(f'HTTPS handle resolution failed: {e}')
-        return None
+        return None, None
 
     if resp.ok:
         did = resp.text.strip()
         if did.startswith('did:plc:') and len(did.removeprefix('did:plc:')) <= 24:
-            return did
+            return did, _max_age(resp)
 
-    return None
+    return None, _max_age(resp)
@@ -44,21 +44,23 @@ If the first leaf in a tree is ``bsky/posts/abcdefg`` and the second is
 'bsky/posts/abcdefg'``, and the second will be described as ``prefix: 16, key:
 'hi'``.
 """
+from bisect import bisect_left
 from collections import namedtuple
-import copy
+from functools import lru_cache
 from hashlib import sha256
 import logging
-from os.path import commonprefix
 import re
 
 import dag_cbor
 from multiformats import CID
 
 from .storage import Block, Storage
-from .util import dag_cbor_cid
 
 logger = logging.getLogger(__name__)
 
+# collection and record key, separated by a single slash
+VALID_KEY_RE = re.compile(r'[a-zA-Z0-9_\-:.]+/[a-zA-Z0-9_\-:.]+')
+
 # this is treeEntry in mst.ts
 Entry = namedtuple('Entry', [
     'p',  # int, length of prefix that this data key shares with the prev data key
@@ -83,7 +85,7 @@ class MST:
 
     Attributes:
       storage (Storage):
-      entries (sequence of MST and Leaf)
+      entries (tuple of MST and Leaf): never modified once set
       layer (int): this MST's layer in the root MST
       pointer (CID):
       outdated_pointer (bool): whether pointer needs to be recalculated
@@ -93,6 +95,13 @@ class MST:
     layer = None
     pointer = None
     outdated_pointer = False
+    # Block for entries, cached when pointer is calculated from them
+    _block = None
+    # cached by leaf_count
+    _leaf_count = None
+    # cached by find_gt_or_equal_leaf_index
+    _leaf_keys = None     # list of str, keys of Leafs in entries
+    _leaf_indices = None  # list of int, indices of Leafs in entries
 
     def __init__(self, *, storage=None, entries=None, pointer=None, layer=None):
         """Constructor.
@@ -107,7 +116,7 @@ class MST:
           MST:
         """
         self.storage = storage
-        self.entries = entries
+        self.entries = tuple(entries) if entries is not None else None
         self.pointer = pointer
         self.layer = layer
 
@@ -129,8 +138,10 @@ class MST:
         """
         if not entries:
             entries = []
-        pointer = cid_for_entries(entries)
-        return MST(storage=storage, entries=entries, pointer=pointer, layer=layer)
+        block = block_for_entries(entries)
+        mst = MST(storage=storage, entries=entries, pointer=block.cid, layer=layer)
+        mst._block = block
+        return mst
 
 #     def from_data(storage, data, opts):
 #         """
@@ -177,19 +188,22 @@ class MST:
         We don't want to load entries of every subtree, just the ones we need.
 
         Returns:
-          sequence of MST and Leaf:
+          tuple of MST and Leaf: immutable, so we can return it without copying
         """
         if self.entries is not None:
-            return copy.copy(self.entries)
+            return self.entries
 
         if self.pointer:
             data = Data(**self.storage.read(self.pointer).decoded)
-            first_leaf = layer = None
-            if data.e:
-                layer = leading_zeros_on_hash(data.e[0]['k'])
-
-            self.entries = deserialize_node_data(storage=self.storage, data=data,
-                                                 layer=layer)
+            # remember the layer so that get_layer doesn't need to look for it
+            if self.layer is None and data.e:
+                self.layer = leading_zeros_on_hash(data.e[0]['k'])
+            layer = self.layer
+
+            # nodes in storage were written by serialize_node_data, which
+            # already validated their keys
+            self.entries = tuple(deserialize_node_data(
+                storage=self.storage, data=data, layer=layer, validate_keys=False))
             return self.entries
 
         raise RuntimeError('No entries or CID provided')
@@ -217,7 +231,8 @@ class MST:
         if outdated:
             entries = self.get_entries()
 
-        self.pointer = cid_for_entries(entries)
+        self._block = block_for_entries(entries)
+        self.pointer = self._block.cid
         self.outdated_pointer = False
         return self.pointer
 
@@ -276,18 +291,29 @@ class MST:
         unstored = {}
         pointer = self.get_pointer()
 
-        if self.storage.has(pointer):
-            return pointer, unstored
+        # breadth first, one layer at a time, so that we can check which nodes
+        # are already stored with one batch read per layer instead of one read
+        # per node
+        nodes = [self]
+        while nodes:
+            stored = self.storage.read_many([node.get_pointer() for node in nodes])
+            children = []
+            for node in nodes:
+                if stored.get(node.get_pointer()) is not None:
+                    continue
 
-        entries = self.get_entries()
-        data = serialize_node_data(entries)
-        block = Block(decoded=data._asdict())
-        unstored[block.cid] = block
+                entries = node.get_entries()
+                if node._block:
+                    # reuse the encoding and CID from get_pointer
+                    block = Block(cid=node._block.cid, decoded=node._block.decoded,
+                                  encoded=node._block.encoded)
+                else:
+                    block = block_for_entries(entries)
+                unstored[block.cid] = block
 
-        for entry in entries:
-            if isinstance(entry, MST):
-                _, blocks = entry.get_unstored_blocks()
-                unstored.update(blocks)
+                children.extend(e for e in entries if isinstance(e, MST))
+
+            nodes = children
 
         return pointer, unstored
 
@@ -297,7 +323,8 @@ class MST:
         Args:
           key (str)
           value (CID)
-          known_zeros (int)
+          known_zeros (int): leading zeros on ``key``'s hash, if the caller
+            already knows it
 
         Returns:
           MST:
@@ -306,7 +333,8 @@ class MST:
           ValueError: if a leaf with that key already exists
         """
         ensure_valid_key(key)
-        key_zeros = known_zeros or leading_zeros_on_hash(key)
+        key_zeros = (leading_zeros_on_hash(key) if known_zeros is None
+                     else known_zeros)
         layer = self.get_layer()
         new_leaf = Leaf(key=key, value=value)
 
@@ -359,7 +387,8 @@ class MST:
             if right:
                 updated.append(right)
 
-            new_root = MST.create(storage=self.storage, entries=updated, layer=key_zeros)
+            # don't calculate the pointer yet, it's calculated lazily when needed
+            new_root = MST(storage=self.storage, entries=updated, layer=key_zeros)
             new_root.outdated_pointer = True
             return new_root
 
@@ -441,7 +470,7 @@ class MST:
             if isinstance(prev, MST) and isinstance(next, MST):
                 merged = prev.append_merge(next)
                 return self.new_tree(
-                    self.slice(0, index - 1) + [merged] + self.slice(index + 2)
+                    self.slice(0, index - 1) + (merged,) + self.slice(index + 2)
                 )
             else:
                 return self.remove_entry(index)
@@ -472,7 +501,7 @@ class MST:
           MST:
         """
         return self.new_tree(
-            entries=self.slice(0, index) + [entry] + self.slice(index + 1))
+            entries=self.slice(0, index) + (entry,) + self.slice(index + 1))
 
     def remove_entry(self, index):
         """Removes the entry at a given index.
@@ -494,7 +523,7 @@ class MST:
         Returns:
           MST:
         """
-        return self.new_tree(self.get_entries() + [entry])
+        return self.new_tree(self.get_entries() + (entry,))
 
     def prepend(self, entry):
         """Prepends an entry to the start of the node.
@@ -505,7 +534,7 @@ class MST:
         Returns:
           MST:
         """
-        return self.new_tree([entry] + self.get_entries())
+        return self.new_tree((entry,) + self.get_entries())
 
     def at_index(self, index):
         """Returns the entry at a given index.
@@ -528,7 +557,7 @@ class MST:
           end (int): optional, exclusive
 
         Returns:
-          sequence of MST and Leaf:
+          tuple of MST and Leaf:
         """
         return self.get_entries()[start:end]
 
@@ -542,7 +571,7 @@ class MST:
         Returns:
           MST:
         """
-        return self.new_tree(self.slice(0, index) + [entry] + self.slice(index))
+        return self.new_tree(self.slice(0, index) + (entry,) + self.slice(index))
 
     def replace_with_split(self, index, left=None, leaf=None, right=None):
         """Replaces an entry with [ Maybe(tree), Leaf, Maybe(tree) ].
@@ -556,7 +585,7 @@ class MST:
         Returns:
           MST:
         """
-        updated = self.slice(0, index)
+        updated = list(self.slice(0, index))
         if left:
             updated.append(left)
         updated.append(leaf)
@@ -639,7 +668,7 @@ class MST:
         if isinstance(last_in_left, MST) and isinstance(first_in_right, MST):
             merged = last_in_left.append_merge(first_in_right)
             return self.new_tree(
-                list(self_entries[:-1]) + [merged] + to_merge_entries[1:])
+                self_entries[:-1] + (merged,) + to_merge_entries[1:])
         else:
             return self.new_tree(self_entries + to_merge_entries)
 
@@ -660,8 +689,9 @@ class MST:
         Returns:
           MST:
         """
-        parent = MST.create(storage=self.storage, entries=[self],
-                            layer=self.get_layer() + 1)
+        # don't calculate the pointer yet, it's calculated lazily when needed
+        parent = MST(storage=self.storage, entries=[self],
+                     layer=self.get_layer() + 1)
         parent.outdated_pointer = True
         return parent
 
@@ -679,9 +709,17 @@ class MST:
           int:
         """
         entries = self.get_entries()
-        for i, entry in enumerate(entries):
-            if isinstance(entry, Leaf) and entry.key >= key:
-                return i
+
+        # entries never change once they're set, so we can cache their keys.
+        # leaves are sorted, so we can binary search them.
+        if self._leaf_keys is None:
+            self._leaf_indices = [i for i, entry in enumerate(entries)
+                                  if isinstance(entry, Leaf)]
+            self._leaf_keys = [entries[i].key for i in self._leaf_indices]
+
+        i = bisect_left(self._leaf_keys, key)
+        if i < len(self._leaf_indices):
+            return self._leaf_indices[i]
 
         # if we can't find it, we're on the end
         return len(entries)
@@ -701,21 +739,23 @@ class MST:
         Generates:
           Leaf
         """
-        index = self.find_gt_or_equal_leaf_index(key)
-        entries = self.get_entries()
-
-        if index > 0:
-            prev = entries[index - 1]
-            if prev and isinstance(prev, MST):
-                for e in prev.walk_leaves_from(key):
-                    yield e
-
-        for entry in entries[index:]:
+        # iterative instead of recursive so that we don't stack up nested
+        # generators. entries are pushed in reverse so they pop in order.
+        stack = [self]
+        while stack:
+            entry = stack.pop()
             if isinstance(entry, Leaf):
                 yield entry
-            else:
-                for e in entry.walk_leaves_from(key):
-                    yield e
+                continue
+
+            index = entry.find_gt_or_equal_leaf_index(key)
+            entries = entry.get_entries()
+            stack.extend(reversed(entries[index:]))
+
+            if index > 0:
+                prev = entries[index - 1]
+                if prev and isinstance(prev, MST):
+                    stack.append(prev)
 
     def list(self, after=None, before=None):
         """Returns entries, optionally bounded within a key range.
@@ -765,14 +805,14 @@ class MST:
         Returns:
           generator of MST and Leaf:
         """
-        yield self
-
-        for entry in self.get_entries():
-            if isinstance(entry, MST):
-                for e in entry.walk():
-                    yield e
-            else:
-                yield entry
+        # iterative instead of recursive so that we don't stack up nested
+        # generators. entries are pushed in reverse so they pop in order.
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            if isinstance(node, MST):
+                stack.extend(reversed(node.get_entries()))
 
 #     Walk full tree & emit nodes, consumer can bail at any point by returning False
 #     def paths():
@@ -820,15 +860,33 @@ class MST:
         Returns:
           sequence of Leaf:
         """
-        return [entry for entry in self.walk() if isinstance(entry, Leaf)]
+        leaves = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Leaf):
+                leaves.append(node)
+            else:
+                stack.extend(reversed(node.get_entries()))
+
+        return leaves
 
     def leaf_count(self):
         """Returns the total number of leaves in this MST.
 
+        Cached, since entries never change. Subtrees are shared between a tree
+        and the new trees derived from it, so after an edit, only the nodes
+        along the edited path need to count again.
+
         Returns:
           int:
         """
-        return len(self.leaves())
+        if self._leaf_count is None:
+            self._leaf_count = sum(
+                entry.leaf_count() if isinstance(entry, MST) else 1
+                for entry in self.get_entries())
+
+        return self._leaf_count
 
 
 #     Reachable tree traversal
@@ -893,14 +951,16 @@ class MST:
                     continue
 
                 yield cid, block.encoded
-                entries = deserialize_node_data(storage=self.storage,
-                                                data=Data(**block.decoded))
 
-                for entry in entries:
-                    if isinstance(entry, Leaf):
-                        leaves.add(entry.value)
-                    else:
-                        to_fetch.add(entry.get_pointer())
+                # we only need CIDs here, not keys, so read them straight out
+                # of the node data instead of deserializing it into entries
+                data = block.decoded
+                if data['l'] is not None:
+                    to_fetch.add(data['l'])
+                for entry in data['e']:
+                    leaves.add(entry['v'])
+                    if entry['t'] is not None:
+                        to_fetch.add(entry['t'])
 
         leaf_blocks = self.storage.read_many(leaves)
         for cid, block in leaf_blocks.items():
@@ -926,9 +986,13 @@ class MST:
 #         return cids
 
 
+@lru_cache(maxsize=65536)
 def leading_zeros_on_hash(key):
     """Returns the number of leading zeros in a key's hash.
 
+    Cached, since the same keys get hashed repeatedly as they move through
+    :meth:`MST.add`, :meth:`MST.split_around`, node loads, etc.
+
     Args:
       key (str or bytes)
 
@@ -938,20 +1002,9 @@ def leading_zeros_on_hash(key):
     if not isinstance(key, bytes):
         key = key.encode()  # ensure_valid_key enforces that this is ASCII only
 
-    leading_zeros = 0
-    for byte in sha256(key).digest():
-        if byte < 64:
-             leading_zeros += 1
-        if byte < 16:
-             leading_zeros += 1
-        if byte < 4:
-             leading_zeros += 1
-        if byte == 0:
-            leading_zeros += 1
-        else:
-            break
-
-    return leading_zeros
+    # ~4 fanout, so count leading zero bits in pairs
+    hash = int.from_bytes(sha256(key).digest(), 'big')
+    return (256 - hash.bit_length()) >> 1
 
 
 def layer_for_entries(entries):
@@ -967,31 +1020,36 @@ def layer_for_entries(entries):
             return leading_zeros_on_hash(entry.key)
 
 
-def deserialize_node_data(*, storage=None, data=None, layer=None):
+def deserialize_node_data(*, storage=None, data=None, layer=None,
+                          validate_keys=True):
     """
     Args:
       storage (Storage)
       data (Data)
+      layer (int)
+      validate_keys (bool): whether to check that keys are valid. Only pass
+        False for data that's already been validated, eg from our own storage.
 
     Returns:
       sequence of MST and Leaf:
     """
+    child_layer = layer - 1 if layer else None
     entries = []
     if (data.l is not None):
-        entries.append(MST(storage=storage, pointer=data.l,
-                           layer=layer - 1 if layer else None))
+        entries.append(MST(storage=storage, pointer=data.l, layer=child_layer))
 
-    last_key = ''
+    # reuse one buffer to rebuild prefix-compressed keys instead of slicing
+    # and concatenating strs for each entry
+    key_buf = bytearray()
     for entry_data in data.e:
         entry = Entry(**entry_data)
-        key_str = entry.k.decode()
-        key = last_key[:entry.p] + key_str
-        ensure_valid_key(key)
+        key_buf[entry.p:] = entry.k
+        key = key_buf.decode()
+        if validate_keys:
+            ensure_valid_key(key)
         entries.append(Leaf(key, entry.v))
-        last_key = key
         if entry.t is not None:
-            entries.append(MST(storage=storage, pointer=entry.t,
-                               layer=layer - 1 if layer else None))
+            entries.append(MST(storage=storage, pointer=entry.t, layer=child_layer))
 
     return entries
 
@@ -1002,45 +1060,46 @@ def serialize_node_data(entries):
       entries (sequence of MST and Leaf)
 
     Returns:
-      Data:
+      Data: ``e`` is a list of dicts with :class:`Entry`'s fields
     """
+    # one pass, one isinstance check per entry. leaf-only nodes, ie most of
+    # them, never take the subtree branches.
     l = None
-    i = 0
-    if entries and isinstance(entries[0], MST):
-        i += 1
-        l = entries[0].get_pointer()
-
-    data = Data(l=l, e=[])
+    e = []
     last_key = ''
-    while i < len(entries):
-        leaf = entries[i]
-        next = entries[i + 1] if i < len(entries) - 1 else None
-
-        if not isinstance(leaf, Leaf):
+    prev_leaf = False
+    for entry in entries:
+        if isinstance(entry, Leaf):
+            ensure_valid_key(entry.key)
+            prefix_len = common_prefix_len(last_key, entry.key)
+            # same fields as Entry, but build the dict directly instead of
+            # constructing an Entry and converting it with _asdict()
+            e.append({
+                'p': prefix_len,
+                'k': entry.key[prefix_len:].encode('ascii'),
+                'v': entry.value,
+                't': None,
+            })
+            last_key = entry.key
+            prev_leaf = True
+            continue
+
+        if prev_leaf:
+            e[-1]['t'] = entry.get_pointer()
+        elif not e and l is None:
+            l = entry.get_pointer()
+        else:
             raise ValueError('Not a valid node: two subtrees next to each other')
-        i += 1
-
-        subtree = None
-        if next and isinstance(next, MST):
-            subtree = next.get_pointer()
-            i += 1
+        prev_leaf = False
 
-        ensure_valid_key(leaf.key)
-        prefix_len = common_prefix_len(last_key, leaf.key)
-        data.e.append(Entry(
-            p=prefix_len,
-            k=leaf.key[prefix_len:].encode('ascii'),
-            v=leaf.value,
-            t=subtree,
-        )._asdict())
-
-        last_key = leaf.key
-
-    return data
+    return Data(l=l, e=e)
 
 
 def common_prefix_len(a, b):
     """
+    Binary searches on the prefix length, since slice comparisons happen in C
+    and are much faster than comparing character by character in Python.
+
     Args:
       a (str)
       b (str)
@@ -1048,7 +1107,31 @@ def common_prefix_len(a, b):
     Returns:
       int:
     """
-    return len(commonprefix((a, b)))
+    n = min(len(a), len(b))
+    if a[:n] == b[:n]:
+        return n
+
+    # invariant: a[:lo] == b[:lo], a[:hi] != b[:hi]
+    lo, hi = 0, n
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid
+
+    return lo
+
+
+def block_for_entries(entries):
+    """
+    Args:
+      entries (sequence of MST and Leaf)
+
+    Returns:
+      Block:
+    """
+    return Block(decoded=serialize_node_data(entries)._asdict())
 
 
 def cid_for_entries(entries):
@@ -1059,7 +1142,7 @@ def cid_for_entries(entries):
     Returns:
       CID
     """
-    return dag_cbor_cid(serialize_node_data(entries)._asdict())
+    return block_for_entries(entries).cid
 
 
 def ensure_valid_key(key):
@@ -1070,24 +1153,39 @@ def ensure_valid_key(key):
     Raises:
       ValueError: if key is not a valid MST key
     """
-    valid = re.compile('[a-zA-Z0-9_\-:.]*$')
-    split = key.split('/')
-    if not (len(key) <= 256 and
-            len(split) == 2 and
-            split[0] and
-            split[1] and
-            valid.match(split[0]) and
-            valid.match(split[1])
-            ):
+    if not (len(key) <= 256 and VALID_KEY_RE.fullmatch(key)):
         raise ValueError(f'Invalid MST key: {key}')
 
 
-WalkStatus = namedtuple('WalkStatus', [
-    'done',     # bool
-    'cur',      # MST or Leaf
-    'walking',  # MST or None if cur is the root of the tree
-    'index',    # int
-], defaults=[None, None, None, None])
+class WalkStatus:
+    """A :class:`Walker`'s position in the tree.
+
+    Mutable, unlike a namedtuple, so that :meth:`Walker.step_over` can update
+    it in place instead of allocating a new one on every step.
+
+    Attributes:
+      done (bool)
+      cur (MST or Leaf)
+      walking (MST): or None if cur is the root of the tree
+      index (int)
+    """
+    __slots__ = ('done', 'cur', 'walking', 'index')
+
+    def __init__(self, done=None, cur=None, walking=None, index=None):
+        self.done = done
+        self.cur = cur
+        self.walking = walking
+        self.index = index
+
+    def __eq__(self, other):
+        if not isinstance(other, WalkStatus):
+            return NotImplemented
+        return ((self.done, self.cur, self.walking, self.index) ==
+                (other.done, other.cur, other.walking, other.index))
+
+    def __repr__(self):
+        return (f'WalkStatus(done={self.done!r}, cur={self.cur!r}, '
+                f'walking={self.walking!r}, index={self.index!r})')
 
 
 class Walker:
@@ -1139,7 +1237,7 @@ class Walker:
             return
 
         entries = self.status.walking.get_entries()
-        self.status = self.status._replace(index=self.status.index + 1)
+        self.status.index += 1
 
         if self.status.index >= len(entries):
             if not self.stack:
@@ -1148,7 +1246,7 @@ class Walker:
                 self.status = self.stack.pop()
                 self.step_over()
         else:
-            self.status = self.status._replace(cur=entries[self.status.index])
+            self.status.cur = entries[self.status.index]
 
     def step_into(self):
         """Steps into a subtree.
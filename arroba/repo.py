@@ -10,13 +10,14 @@ Daniel Holmgren and Devin Ivy for this code specifically!
 """
 from collections import defaultdict, namedtuple
 import logging
+from threading import Lock
 
+from cachetools import cached, LRUCache
 from cryptography.hazmat.primitives.asymmetric import ec
 import dag_cbor
 from multiformats import CID
 
 from . import util
-from .diff import Diff
 from .mst import MST
 from .server import server
 from .storage import (
@@ -30,6 +31,9 @@ from .storage import (
 
 logger = logging.getLogger(__name__)
 
+# number of (MST root, key) => record CID lookups to cache for Repo.get_record
+MST_GET_CACHE_SIZE = 4096
+
 
 Write = namedtuple('Write', [
     'action',      # :class:`Action`
@@ -39,6 +43,24 @@ Write = namedtuple('Write', [
 ], defaults=[None] * 4)
 
 
+@cached(LRUCache(maxsize=MST_GET_CACHE_SIZE),
+        key=lambda mst, key: (mst.get_pointer(), key), lock=Lock())
+def _mst_get(mst, key):
+    """Cached :meth:`MST.get`.
+
+    MSTs are content addressed, so a given root CID always maps a given key to
+    the same value, regardless of storage. Cached entries never go stale.
+
+    Args:
+      mst (MST)
+      key (str)
+
+    Returns:
+      CID or None:
+    """
+    return mst.get(key)
+
+
 def writes_to_commit_ops(writes):
     r"""Converts :class:`Write`\s to :class:`CommitOp`\s.
 
@@ -137,7 +159,7 @@ class Repo:
         Returns:
           dict: node, record or commit or serialized :class:`MST`
         """
-        cid = self.mst.get(f'{collection}/{rkey}')
+        cid = _mst_get(self.mst, f'{collection}/{rkey}')
         if cid:
             return self.storage.read(cid).decoded
 
@@ -147,12 +169,19 @@ class Repo:
         Returns:
           dict mapping str collection to dict mapping str rkey to dict record:
         """
-        entries = self.mst.list()
-        blocks = self.storage.read_many([e.value for e in entries])
+        entries = self.mst.leaves()
+        # identical records share a CID, so only read each one once
+        blocks = self.storage.read_many(list(dict.fromkeys(e.value for e in entries)))
+
+        # leaves are sorted by key, so each collection's records are contiguous
         contents = defaultdict(dict)
+        collection = records = None
         for entry in entries:
-            collection, rkey = entry.key.split('/', 2)
-            contents[collection][rkey] = blocks[entry.value].decoded
+            entry_collection, _, rkey = entry.key.partition('/')
+            if entry_collection != collection:
+                collection = entry_collection
+                records = contents[collection]
+            records[rkey] = blocks[entry.value].decoded
 
         return contents
 
@@ -270,12 +299,15 @@ class Repo:
             cur_head = repo.head.cid
 
         if not mst:
-            mst = MST.create(storage=storage)
+            mst = MST.create(storage=storage, layer=0)
 
         commit_blocks = {}  # maps CID to Block
         if writes is None:
             writes = []
-        orig_mst = mst
+
+        # build these here instead of with writes_to_commit_ops so that we can
+        # reuse data keys and record CIDs instead of encoding records again
+        ops = []
 
         for write in writes:
             assert isinstance(write, Write), type(write)
@@ -283,6 +315,7 @@ class Repo:
 
             if write.action == Action.DELETE:
                 mst = mst.delete(data_key)
+                ops.append(CommitOp(action=write.action, path=data_key, cid=None))
                 continue
 
             # raises ValidationError if it doesn't validate
@@ -295,6 +328,7 @@ class Repo:
             else:
                 assert write.action == Action.UPDATE
                 mst = mst.update(data_key, block.cid)
+            ops.append(CommitOp(action=write.action, path=data_key, cid=block.cid))
 
         root, unstored_blocks = mst.get_unstored_blocks()
         for block in unstored_blocks.values():
@@ -311,8 +345,7 @@ class Repo:
             'prev': cur_head,
             'data': root,
         }, signing_key)
-        commit_block = Block(decoded=commit, ops=writes_to_commit_ops(writes),
-                             repo=repo_did)
+        commit_block = Block(decoded=commit, ops=ops, repo=repo_did)
         commit_blocks[commit_block.cid] = commit_block
 
         if repo:
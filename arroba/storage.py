@@ -309,12 +309,16 @@ class Storage:
         seq = commit_block = blocks = None
 
         def make_commit():
-            for op in commit_block.ops:
+            # fetch records that weren't written in this commit, eg when they
+            # were unchanged or already existed, in one batch
+            missing = list(dict.fromkeys(
+                op.cid for op in commit_block.ops
                 if (op.action in (Action.CREATE, Action.UPDATE)
-                        and op.cid not in blocks):
-                    record = self.read(op.cid)
-                    assert record
-                    blocks[op.cid] = record
+                    and op.cid not in blocks)))
+            if missing:
+                for cid, record in self.read_many(missing).items():
+                    assert record, cid
+                    blocks[cid] = record
             return CommitData(blocks=blocks, commit=commit_block,
                               prev=commit_block.decoded.get('prev'))
 
@@ -1,17 +1,28 @@
 """Unit tests for did.py."""
+import asyncio
 import base64
 import copy
-from unittest.mock import MagicMock, patch
+import gc
+import hashlib
+import http.client
+import json
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+import weakref
 
 from cryptography.hazmat.primitives.asymmetric import ec
+import dag_cbor
 from dns.rdatatype import TXT
+import dns.exception
 import dns.resolver
 import requests
 
 from .. import did
 from .. import util
 
-from .testutil import dns_answer, requests_response, TestCase
+from .testutil import dns_answer, NOW, requests_response, TestCase
+
+NOW_NS = int(NOW.timestamp() * 1000 * 1000 * 1000)
 
 
 class DidTest(TestCase):
@@ -25,11 +36,160 @@ class DidTest(TestCase):
         self.assertEqual({'foo': 'bar'}, doc)
         self.mock_get.assert_called_with('https://plc.bsky-sandbox.dev/did:plc:123')
 
+    def test_resolve_plc_cached(self):
+        did.resolve_plc('did:plc:123', get_fn=self.mock_get)
+        did.resolve_plc('did:plc:123', get_fn=self.mock_get)
+        self.mock_get.assert_called_once()
+
+        # past default TTL and stale window
+        expired = did.CACHE_TTL + did.CACHE_STALE_TTL
+        util.time_ns = lambda: NOW_NS + int(expired.total_seconds() * 1e9)
+        did.resolve_plc('did:plc:123', get_fn=self.mock_get)
+        self.assertEqual(2, self.mock_get.call_count)
+
+    def test_resolve_plc_cache_control_max_age(self):
+        self.mock_get.return_value = requests_response(
+            {'foo': 'bar'}, headers={'Cache-Control': 'public, max-age=120'})
+        did.resolve_plc('did:plc:123', get_fn=self.mock_get)
+
+        util.time_ns = lambda: NOW_NS + 119 * 10**9
+        did.resolve_plc('did:plc:123', get_fn=self.mock_get)
+        self.mock_get.assert_called_once()
+
+        stale_ns = int(did.CACHE_STALE_TTL.total_seconds() * 1e9)
+        util.time_ns = lambda: NOW_NS + 120 * 10**9 + stale_ns
+        did.resolve_plc('did:plc:123', get_fn=self.mock_get)
+        self.assertEqual(2, self.mock_get.call_count)
+
+    def test_resolve_plc_cache_control_max_age_0(self):
+        self.mock_get.return_value = requests_response(
+            {'foo': 'bar'}, headers={'Cache-Control': 'max-age=0'})
+        did.resolve_plc('did:plc:123', get_fn=self.mock_get)
+
+        # clamped up to MIN_CACHE_TTL, not defaulted to CACHE_TTL
+        min_ns = int(did.MIN_CACHE_TTL.total_seconds() * 1e9)
+        util.time_ns = lambda: NOW_NS + min_ns - 1
+        did.resolve_plc('did:plc:123', get_fn=self.mock_get)
+        self.mock_get.assert_called_once()
+
+        stale_ns = int(did.CACHE_STALE_TTL.total_seconds() * 1e9)
+        util.time_ns = lambda: NOW_NS + min_ns + stale_ns
+        did.resolve_plc('did:plc:123', get_fn=self.mock_get)
+        self.assertEqual(2, self.mock_get.call_count)
+
+    def test_resolve_plc_stale_while_revalidate(self):
+        did.resolve_plc('did:plc:123', get_fn=self.mock_get)
+
+        self.mock_get.return_value = requests_response({'new': 'doc'})
+        util.time_ns = lambda: NOW_NS + int(did.CACHE_TTL.total_seconds() * 1e9)
+        self.assertEqual({'foo': 'bar'},
+                         did.resolve_plc('did:plc:123', get_fn=self.mock_get))
+
+        for future in list(did.resolve_plc.refreshes.values()):
+            future.result()
+
+        self.assertEqual(2, self.mock_get.call_count)
+        self.assertEqual({'new': 'doc'},
+                         did.resolve_plc('did:plc:123', get_fn=self.mock_get))
+        self.assertEqual(2, self.mock_get.call_count)
+
     def test_resolve_plc_bad_input(self):
         for bad in None, 1, 'foo', 'did:web:x':
             with self.assertRaises(ValueError):
                 did.resolve_plc(bad)
 
+    def test_resolve_plc_many(self):
+        self.mock_get.side_effect = lambda url: (
+            requests_response('', status=404) if url.endswith('/did:plc:bad')
+            else requests_response({'url': url}))
+
+        docs = did.resolve_plc_many(
+            ['did:plc:1', 'did:plc:2', 'did:plc:1', 'did:plc:bad'],
+            get_fn=self.mock_get)
+        self.assertEqual({
+            'did:plc:1': {'url': 'https://plc.bsky-sandbox.dev/did:plc:1'},
+            'did:plc:2': {'url': 'https://plc.bsky-sandbox.dev/did:plc:2'},
+        }, docs)
+        self.assertEqual(3, self.mock_get.call_count)
+
+        with self.assertRaises(requests.HTTPError):
+            did.resolve_plc_many(['did:plc:bad'], get_fn=self.mock_get,
+                                 raise_on_error=True)
+
+    @patch.object(did, 'httpx', None)
+    @patch('requests.Session.get')
+    def test_resolve_plc_async_shares_cache(self, mock_get):
+        mock_get.return_value = requests_response({'foo': 'bar'})
+
+        self.assertEqual({'foo': 'bar'},
+                         asyncio.run(did.resolve_plc_async('did:plc:123')))
+        self.assertEqual({'foo': 'bar'}, did.resolve_plc('did:plc:123'))
+        self.assertEqual({'foo': 'bar'},
+                         asyncio.run(did.resolve_plc_async('did:plc:123')))
+        mock_get.assert_called_once_with('https://plc.bsky-sandbox.dev/did:plc:123')
+
+    @patch.object(did, 'httpx', None)
+    @patch('requests.Session.get')
+    def test_resolve_web_async(self, mock_get):
+        mock_get.return_value = requests_response({'foo': 'bar'})
+        self.assertEqual({'foo': 'bar'},
+                         asyncio.run(did.resolve_web_async('did:web:abc.com')))
+        mock_get.assert_called_once_with('https://abc.com/.well-known/did.json')
+
+        with self.assertRaises(ValueError):
+            asyncio.run(did.resolve_web_async('did:plc:123'))
+
+    @patch.object(did, 'httpx')
+    def test_resolve_plc_async_closes_httpx_client(self, mock_httpx):
+        client = mock_httpx.AsyncClient.return_value
+        client.get = AsyncMock(return_value=requests_response({'foo': 'bar'}))
+        client.aclose = AsyncMock()
+
+        self.assertEqual({'foo': 'bar'},
+                         asyncio.run(did.resolve_plc_async('did:plc:123')))
+        client.get.assert_awaited_once_with(
+            'https://plc.bsky-sandbox.dev/did:plc:123')
+        client.aclose.assert_awaited_once()
+
+    @patch.object(did, 'httpx')
+    def test_get_async_run_until_complete_doesnt_keep_loop_alive(self, mock_httpx):
+        client = mock_httpx.AsyncClient.return_value
+        client.get = AsyncMock(return_value=requests_response({'foo': 'bar'}))
+
+        loops = weakref.WeakSet()
+        for _ in range(3):
+            loop = asyncio.new_event_loop()
+            loops.add(loop)
+            loop.run_until_complete(did._get_async('https://foo.com/'))
+            loop.close()
+
+        del loop
+        gc.collect()
+        self.assertEqual(0, len(loops))
+        self.assertEqual(3, mock_httpx.AsyncClient.call_count)
+
+    def test_resolve_plc_async_cancel_one_concurrent_caller(self):
+        async def run():
+            release = asyncio.Event()
+
+            async def get(url):
+                await release.wait()
+                return requests_response({'foo': 'bar'})
+
+            with patch.object(did, '_get_async', get):
+                first = asyncio.ensure_future(did.resolve_plc_async('did:plc:abc'))
+                second = asyncio.ensure_future(did.resolve_plc_async('did:plc:abc'))
+                await asyncio.sleep(0)
+
+                first.cancel()
+                await asyncio.sleep(0)
+                release.set()
+                with self.assertRaises(asyncio.CancelledError):
+                    await first
+                return await second
+
+        self.assertEqual({'foo': 'bar'}, asyncio.run(run()))
+
     def test_resolve_web_no_path(self):
         doc = did.resolve_web('did:web:abc.com', get_fn=self.mock_get)
         self.assertEqual({'foo': 'bar'}, doc)
@@ -59,6 +219,13 @@ class DidTest(TestCase):
         self.assertEqual({'foo': 'bar'}, doc)
         self.mock_get.assert_called_with('https://abc.com/.well-known/did.json')
 
+    def test_resolve_bad_input(self):
+        for bad in None, '', 'did:', 'did:plc', 'did:plcx:123', 'did:foo:bar':
+            with self.assertRaises(ValueError):
+                did.resolve(bad, get_fn=self.mock_get)
+
+        self.mock_get.assert_not_called()
+
     def test_create_plc(self):
         mock_post = MagicMock(return_value=requests_response('OK'))
         did_plc = did.create_plc('han.dull', post_fn=mock_post)
@@ -73,8 +240,9 @@ class DidTest(TestCase):
         self.assertEqual((f'https://plc.bsky-sandbox.dev/{did_plc.did}',),
                          mock_post.call_args.args)
 
-        genesis_op = mock_post.call_args.kwargs['json']
-        self.assertEqual(did_plc.did, genesis_op.pop('did'))
+        self.assertEqual({'Content-Type': 'application/json'},
+                         mock_post.call_args.kwargs['headers'])
+        genesis_op = json.loads(mock_post.call_args.kwargs['data'])
         genesis_op['sig'] = base64.urlsafe_b64decode(
             genesis_op['sig'] + '=' * (4 - len(genesis_op['sig']) % 4))  # padding
         assert util.verify_sig(genesis_op, did_plc.rotation_key.public_key())
@@ -121,6 +289,16 @@ class DidTest(TestCase):
             }],
         }, did_plc.doc)
 
+    def test_create_plc_did_is_hash_of_signed_op(self):
+        mock_post = MagicMock(return_value=requests_response('OK'))
+        did_plc = did.create_plc('han.dull', also_known_as=['abc'],
+                                 post_fn=mock_post)
+
+        genesis_op = json.loads(mock_post.call_args.kwargs['data'])
+        hash = hashlib.sha256(dag_cbor.encode(genesis_op)).digest()
+        self.assertEqual('did:plc:' + base64.b32encode(hash)[:24].lower().decode(),
+                         did_plc.did)
+
     def test_create_plc_also_known_as(self):
         mock_post = MagicMock(return_value=requests_response('OK'))
         did_plc = did.create_plc('han.dull', also_known_as=['abc', 'xyz'],
@@ -132,7 +310,7 @@ class DidTest(TestCase):
 
         self.assertTrue(did_plc.did.startswith('did:plc:'))
         self.assertEqual(['at://han.dull', 'abc', 'xyz'], did_plc.doc['alsoKnownAs'])
-        genesis_op = mock_post.call_args.kwargs['json']
+        genesis_op = json.loads(mock_post.call_args.kwargs['data'])
         self.assertEqual(['at://han.dull', 'abc', 'xyz'], genesis_op['alsoKnownAs'])
 
     def test_update_plc(self):
@@ -173,8 +351,7 @@ class DidTest(TestCase):
         self.assertEqual((f'https://plc.bsky-sandbox.dev/{did_plc.did}',),
                          mock_post.call_args.args)
 
-        update_op = mock_post.call_args.kwargs['json']
-        self.assertEqual('did:plc:xyz', update_op.pop('did'))
+        update_op = json.loads(mock_post.call_args.kwargs['data'])
 
         update_op['sig'] = base64.urlsafe_b64decode(
             update_op['sig'] + '=' * (4 - len(update_op['sig']) % 4))  # padding
@@ -212,8 +389,7 @@ class DidTest(TestCase):
         self.assertEqual((f'https://plc.bsky-sandbox.dev/{did_plc.did}',),
                          mock_post.call_args.args)
 
-        update_op = mock_post.call_args.kwargs['json']
-        self.assertEqual('did:plc:xyz', update_op.pop('did'))
+        update_op = json.loads(mock_post.call_args.kwargs['data'])
 
         update_op['sig'] = base64.urlsafe_b64decode(
             update_op['sig'] + '=' * (4 - len(update_op['sig']) % 4))  # padding
@@ -235,12 +411,120 @@ class DidTest(TestCase):
             'verificationMethods': {'atproto': did_key}
         }, update_op)
 
+    def test_update_plc_twice_uses_cached_head(self):
+        mock_get = MagicMock(return_value=requests_response([{
+            'operation': {'alsoKnownAs': ['at://han.dull', 'http://han.dy']},
+            'cid': 'orig',
+        }]))
+        mock_post = MagicMock(return_value=requests_response('OK'))
+
+        did.update_plc('did:plc:xyz', get_fn=mock_get, post_fn=mock_post,
+                       handle='new.ie', signing_key=self.key,
+                       rotation_key=self.key)
+        first_op = json.loads(mock_post.call_args.kwargs['data'])
+
+        did_plc = did.update_plc('did:plc:xyz', get_fn=mock_get,
+                                 post_fn=mock_post, signing_key=self.key,
+                                 rotation_key=self.key)
+        mock_get.assert_called_once()
+        self.assertEqual(['at://new.ie', 'http://han.dy'],
+                         did_plc.doc['alsoKnownAs'])
+
+        second_op = json.loads(mock_post.call_args.kwargs['data'])
+        self.assertEqual(util.dag_cbor_cid(first_op).encode('base32'),
+                         second_op['prev'])
+
+    def test_update_plc_error_evicts_cached_head(self):
+        mock_get = MagicMock(return_value=requests_response([{
+            'operation': {'alsoKnownAs': ['at://han.dull']},
+            'cid': 'orig',
+        }]))
+        mock_post = MagicMock(return_value=requests_response('OK'))
+        did.update_plc('did:plc:xyz', get_fn=mock_get, post_fn=mock_post,
+                       signing_key=self.key, rotation_key=self.key)
+
+        # fails with the cached head, then again with the audit log's head
+        mock_post.return_value = requests_response('nope', status=400)
+        with self.assertRaises(requests.HTTPError):
+            did.update_plc('did:plc:xyz', get_fn=mock_get, post_fn=mock_post,
+                           signing_key=self.key, rotation_key=self.key)
+        self.assertEqual(2, mock_get.call_count)
+        self.assertEqual(3, mock_post.call_count)
+
+        mock_post.return_value = requests_response('OK')
+        did.update_plc('did:plc:xyz', get_fn=mock_get, post_fn=mock_post,
+                       signing_key=self.key, rotation_key=self.key)
+        self.assertEqual(3, mock_get.call_count)
+        self.assertEqual('orig', json.loads(mock_post.call_args.kwargs['data'])['prev'])
+
+    def test_update_plc_cached_head_doesnt_retry_5xx_or_timeout(self):
+        mock_get = MagicMock(return_value=requests_response([{
+            'operation': {'alsoKnownAs': ['at://han.dull']},
+            'cid': 'orig',
+        }]))
+        mock_post = MagicMock(return_value=requests_response('OK'))
+        kwargs = {'get_fn': mock_get, 'post_fn': mock_post,
+                  'signing_key': self.key, 'rotation_key': self.key}
+
+        for err, status in ((requests.HTTPError, 503),
+                            (requests.Timeout, None)):
+            with self.subTest(err=err):
+                did.update_plc('did:plc:xyz', **kwargs)
+                mock_get.reset_mock()
+                mock_post.reset_mock()
+
+                if status:
+                    mock_post.return_value = requests_response('', status=status)
+                else:
+                    mock_post.side_effect = err()
+
+                with self.assertRaises(err):
+                    did.update_plc('did:plc:xyz', **kwargs)
+                mock_get.assert_not_called()
+                mock_post.assert_called_once()
+
+                mock_post.return_value = requests_response('OK')
+                mock_post.side_effect = None
+
+    def test_update_plc_stale_cached_head_retries_with_audit_log(self):
+        mock_get = MagicMock(return_value=requests_response([{
+            'operation': {'alsoKnownAs': ['at://han.dull']},
+            'cid': 'orig',
+        }]))
+        mock_post = MagicMock(return_value=requests_response('OK'))
+        did.update_plc('did:plc:xyz', get_fn=mock_get, post_fn=mock_post,
+                       signing_key=self.key, rotation_key=self.key)
+
+        # someone else updated the DID, so our cached head is stale
+        mock_get.return_value = requests_response([{
+            'operation': {'alsoKnownAs': ['at://other.handle']},
+            'cid': 'theirs',
+        }])
+        mock_post.side_effect = [requests_response('stale prev', status=400),
+                                 requests_response('OK')]
+
+        did_plc = did.update_plc('did:plc:xyz', get_fn=mock_get,
+                                 post_fn=mock_post, signing_key=self.key,
+                                 rotation_key=self.key)
+        self.assertEqual(2, mock_get.call_count)
+        self.assertEqual(['at://other.handle'], did_plc.doc['alsoKnownAs'])
+        self.assertEqual('theirs',
+                         json.loads(mock_post.call_args.kwargs['data'])['prev'])
+
     def test_encode_decode_did_key(self):
         did_key = did.encode_did_key(self.key.public_key())
         self.assertTrue(did_key.startswith('did:key:'))
         decoded = did.decode_did_key(did_key)
         self.assertEqual(self.key.public_key(), decoded)
 
+    def test_decode_did_key_compressed(self):
+        did_key = did.encode_did_key(self.key.public_key())
+        compressed = did.decode_did_key_compressed(did_key)
+        self.assertIsInstance(compressed.curve, ec.SECP256K1)
+        self.assertEqual(33, len(compressed))
+        self.assertEqual(did_key, did.encode_did_key(compressed))
+        self.assertEqual(self.key.public_key(), compressed.to_cryptography())
+
     def test_plc_operation_to_did_doc(self):
         self.assertEqual({
             '@context': [
@@ -283,17 +567,73 @@ class DidTest(TestCase):
             'prev': None,
         }))
 
-    @patch('dns.resolver.resolve')
+    @patch('dns.resolver.Resolver.resolve')
     def test_resolve_handle_dns(self, mock_resolve):
         mock_resolve.return_value = dns_answer(
             '_atproto.foo.com.', '"did=did:plc:123abc"')
+        # the HTTPS method runs concurrently, but DNS wins
+        self.mock_get.return_value = requests_response('did:plc:other')
 
         self.assertEqual('did:plc:123abc',
                          did.resolve_handle('foo.com', get_fn=self.mock_get))
         mock_resolve.assert_called_once_with('_atproto.foo.com.', TXT)
-        self.mock_get.assert_not_called()
 
-    @patch('dns.resolver.resolve')
+    @patch('dns.resolver.Resolver.resolve')
+    def test_resolve_handle_dns_takes_precedence(self, mock_resolve):
+        def slow_dns(*args, **kwargs):
+            time.sleep(.1)
+            return dns_answer('_atproto.foo.com.', '"did=did:plc:fromdns"')
+
+        mock_resolve.side_effect = slow_dns
+        self.mock_get.return_value = requests_response('did:plc:fromhttps')
+
+        self.assertEqual('did:plc:fromdns',
+                         did.resolve_handle('foo.com', get_fn=self.mock_get))
+
+    @patch('dns.asyncresolver.Resolver.resolve')
+    def test_resolve_handle_async_dns_takes_precedence(self, mock_resolve):
+        async def slow_dns(*args, **kwargs):
+            await asyncio.sleep(.1)
+            return dns_answer('_atproto.foo.com.', '"did=did:plc:fromdns"')
+
+        mock_resolve.side_effect = slow_dns
+        self.mock_get.return_value = requests_response('did:plc:fromhttps')
+
+        self.assertEqual('did:plc:fromdns', asyncio.run(
+            did.resolve_handle_async('foo.com', get_fn=self.mock_get)))
+
+    @patch('dns.resolver.Resolver.resolve')
+    def test_resolve_handle_dns_non_ascii(self, mock_resolve):
+        mock_resolve.return_value = dns_answer(
+            '_atproto.foo.com.', '"did=did:\\255"')
+        self.mock_get.return_value = requests_response('', status=404)
+
+        self.assertIsNone(did.resolve_handle('foo.com', get_fn=self.mock_get))
+
+    @patch('dns.resolver.Resolver.resolve')
+    def test_resolve_handle_dns_timeout_retries_tcp(self, mock_resolve):
+        mock_resolve.side_effect = [
+            dns.exception.Timeout(),
+            dns_answer('_atproto.foo.com.', '"did=did:plc:123abc"'),
+        ]
+        self.mock_get.return_value = requests_response('', status=404)
+
+        self.assertEqual('did:plc:123abc',
+                         did.resolve_handle('foo.com', get_fn=self.mock_get))
+        self.assertEqual(2, mock_resolve.call_count)
+        mock_resolve.assert_called_with('_atproto.foo.com.', TXT, tcp=True)
+
+    @patch('dns.asyncresolver.Resolver.resolve')
+    def test_resolve_handle_async_dns(self, mock_resolve):
+        mock_resolve.return_value = dns_answer(
+            '_atproto.foo.com.', '"did=did:plc:123abc"')
+        self.mock_get.return_value = requests_response('', status=404)
+
+        self.assertEqual('did:plc:123abc', asyncio.run(
+            did.resolve_handle_async('foo.com', get_fn=self.mock_get)))
+        mock_resolve.assert_called_once_with('_atproto.foo.com.', TXT)
+
+    @patch('dns.resolver.Resolver.resolve')
     def test_resolve_handle_https_well_known(self, mock_resolve):
         mock_resolve.return_value = dns_answer('foo.com.', 'nope')
 
@@ -304,14 +644,14 @@ class DidTest(TestCase):
         mock_resolve.assert_called_once_with('_atproto.foo.com.', TXT)
         self.mock_get.assert_called_with('https://foo.com/.well-known/atproto-did')
 
-    @patch('dns.resolver.resolve')
+    @patch('dns.resolver.Resolver.resolve')
     def test_resolve_handle_https_well_known_not_did(self, mock_resolve):
         mock_resolve.return_value = dns_answer('foo.com.', 'nope')
         self.mock_get.return_value = requests_response('nope')
         self.assertIsNone(did.resolve_handle('foo.com', get_fn=self.mock_get))
         self.mock_get.assert_called_with('https://foo.com/.well-known/atproto-did')
 
-    @patch('dns.resolver.resolve')
+    @patch('dns.resolver.Resolver.resolve')
     def test_resolve_handle_nothing(self, mock_resolve):
         mock_resolve.return_value = dns_answer('_atproto.foo.com.', 'nope')
         self.mock_get.return_value = requests_response('', status=404)
@@ -320,7 +660,7 @@ class DidTest(TestCase):
         mock_resolve.assert_called_once_with('_atproto.foo.com.', TXT)
         self.mock_get.assert_called_with('https://foo.com/.well-known/atproto-did')
 
-    @patch('dns.resolver.resolve', side_effect=dns.resolver.NXDOMAIN())
+    @patch('dns.resolver.Resolver.resolve', side_effect=dns.resolver.NXDOMAIN())
     def test_resolve_handle_nothing_dns_nxdomain_exception(self, mock_resolve):
         self.mock_get.return_value = requests_response('', status=404)
 
@@ -328,7 +668,37 @@ class DidTest(TestCase):
         mock_resolve.assert_called_once_with('_atproto.foo.com.', TXT)
         self.mock_get.assert_called_with('https://foo.com/.well-known/atproto-did')
 
-    @patch('dns.resolver.resolve', side_effect=dns.resolver.NXDOMAIN())
+    def test_session_doesnt_store_cookies(self):
+        headers = http.client.HTTPMessage()
+        headers['Set-Cookie'] = 'foo=bar; Path=/'
+        req = requests.Request('GET', 'https://foo.com/').prepare()
+        did.session.cookies.extract_cookies(
+            requests.cookies.MockResponse(headers),
+            requests.cookies.MockRequest(req))
+        self.assertEqual(0, len(did.session.cookies))
+
+    def test_session_doesnt_reload_ca_certs(self):
+        adapter = did.session.get_adapter('https://foo.com')
+        pool = adapter.poolmanager.connection_from_url('https://foo.com')
+        self.assertIs(did._ssl_context, pool.conn_kw['ssl_context'])
+
+        adapter.cert_verify(pool, 'https://foo.com', True, None)
+        self.assertEqual('CERT_REQUIRED', pool.cert_reqs)
+        self.assertIsNone(pool.ca_certs)
+        self.assertIsNone(pool.ca_cert_dir)
+
+        # custom CA bundles still get loaded
+        bundle = requests.certs.where()
+        adapter.cert_verify(pool, 'https://foo.com', bundle, None)
+        self.assertEqual(bundle, pool.ca_certs)
+
+    def test_resolve_handle_bad_input(self):
+        for bad in (None, 1, '', 'foo', 'http://foo.com', 'foo..com',
+                    'a' * 250 + '.com'):
+            with self.assertRaises(ValueError):
+                did.resolve_handle(bad, get_fn=self.mock_get)
+
+    @patch('dns.resolver.Resolver.resolve', side_effect=dns.resolver.NXDOMAIN())
     def test_resolve_handle_request_exception(self, mock_resolve):
         self.mock_get.side_effect = requests.exceptions.InvalidURL('foo')
 
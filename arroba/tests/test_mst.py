@@ -7,11 +7,21 @@ Huge thanks to the Bluesky team for working in the public, in open source, and t
 Daniel Holmgren and Devin Ivy for this code specifically!
 """
 import random
+from unittest.mock import patch
 
 import dag_cbor.random
 from multiformats import CID
 
-from ..mst import common_prefix_len, ensure_valid_key, MST
+from ..mst import (
+    common_prefix_len,
+    Data,
+    deserialize_node_data,
+    ensure_valid_key,
+    leading_zeros_on_hash,
+    Leaf,
+    MST,
+    WalkStatus,
+)
 from .. import util
 from . import testutil
 
@@ -35,6 +45,12 @@ class MstTest(testutil.TestCase):
 
         self.assertEqual(1000, mst.leaf_count())
 
+    @patch('arroba.mst.leading_zeros_on_hash')
+    def test_add_known_zeros_0_doesnt_rehash(self, mock_zeros):
+        mst = self.mst.add('com.example.record/3jqfcqzm3fo2j', CID1, known_zeros=0)
+        self.assertEqual(CID1, mst.get('com.example.record/3jqfcqzm3fo2j'))
+        mock_zeros.assert_not_called()
+
     def test_edits_records(self):
         mst = self.mst
         data = self.random_keys_and_cids(100)
@@ -86,6 +102,22 @@ class MstTest(testutil.TestCase):
 
         self.assertEqual(all_nodes, recreated.all_nodes())
 
+    def test_leading_zeros_on_hash(self):
+        for key, expected in (
+                ('', 0),
+                ('asdf', 0),
+                ('blue', 1),
+                ('2653ae71', 0),
+                ('88bfafc7', 2),
+                ('2a92d355', 4),
+                ('884976f5', 6),
+                ('app.bsky.feed.post/454397e440ec', 4),
+                ('app.bsky.feed.post/9adeb165882c', 8),
+        ):
+            with self.subTest(key=key):
+                self.assertEqual(expected, leading_zeros_on_hash(key))
+                self.assertEqual(expected, leading_zeros_on_hash(key.encode()))
+
     def test_common_prefix_length(self):
         self.assertEqual(3, common_prefix_len('abc', 'abc'))
         self.assertEqual(0, common_prefix_len('', 'abc'))
@@ -98,9 +130,29 @@ class MstTest(testutil.TestCase):
         self.assertEqual(2, common_prefix_len('abcde', 'abb'))
         self.assertEqual(0, common_prefix_len('abcde', 'qbb'))
         self.assertEqual(0, common_prefix_len('', 'asdf'))
+        self.assertEqual(19, common_prefix_len('app.bsky.feed.post/3k', 'app.bsky.feed.post/4k'))
+        self.assertEqual(20, common_prefix_len('app.bsky.feed.post/3k', 'app.bsky.feed.post/3j'))
         self.assertEqual(3, common_prefix_len('abc', 'abc\x00'))
         self.assertEqual(3, common_prefix_len('abc\x00', 'abc'))
 
+    def test_deserialize_node_data_validate_keys(self):
+        data = Data(l=None, e=[{'p': 0, 'k': b'no-collection', 'v': CID1, 't': None}])
+        with self.assertRaises(ValueError):
+            deserialize_node_data(data=data)
+
+        self.assertEqual([Leaf('no-collection', CID1)],
+                         deserialize_node_data(data=data, validate_keys=False))
+
+    def test_walk_status_eq_repr(self):
+        leaf = Leaf('co/ll', CID1)
+        status = WalkStatus(done=False, cur=leaf, walking=self.mst, index=0)
+        self.assertEqual(WalkStatus(done=False, cur=leaf, walking=self.mst,
+                                    index=0), status)
+        self.assertNotEqual(WalkStatus(done=False, cur=leaf, walking=self.mst,
+                                       index=1), status)
+        self.assertNotEqual((False, leaf, self.mst, 0), status)
+        self.assertTrue(repr(status).startswith('WalkStatus(done=False, cur=Leaf('))
+
     def test_rejects_the_empty_key(self):
         with self.assertRaises(ValueError):
             self.mst.add('')
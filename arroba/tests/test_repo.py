@@ -9,6 +9,7 @@ Daniel Holmgren and Devin Ivy for this code specifically!
 import copy
 from itertools import chain
 import random
+from unittest.mock import patch
 
 import dag_cbor
 
@@ -125,6 +126,21 @@ class RepoTest(TestCase):
                              signing_key=self.key)
         self.assertIsNone(reloaded.get_record('my.stuff', tid))
 
+    def test_get_record_caches_mst_lookup(self):
+        tid = next_tid()
+        self.repo.apply_writes(Write(action=Action.CREATE, collection='my.stuff',
+                                     rkey=tid, record={'foo': 'bar'}))
+        self.assertEqual({'foo': 'bar'}, self.repo.get_record('my.stuff', tid))
+
+        with patch.object(self.repo.mst, 'get') as mock_get:
+            self.assertEqual({'foo': 'bar'}, self.repo.get_record('my.stuff', tid))
+            mock_get.assert_not_called()
+
+        # new commit, new MST root, so this isn't cached
+        self.repo.apply_writes(Write(action=Action.UPDATE, collection='my.stuff',
+                                     rkey=tid, record={'foo': 'baz'}))
+        self.assertEqual({'foo': 'baz'}, self.repo.get_record('my.stuff', tid))
+
     def test_adds_content_collections(self):
         data = {
             'example.foo': self.random_objects(10),
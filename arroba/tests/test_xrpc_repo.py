@@ -35,7 +35,7 @@ class XrpcRepoTest(testutil.XrpcTestCase):
         tid = util.int_to_tid(util._tid_ts_last)
         return f'at://did:web:user.com/app.bsky.feed.post/{tid}'
 
-    @patch('requests.get', return_value=testutil.requests_response({'foo': 'bar'}))
+    @patch('requests.Session.get', return_value=testutil.requests_response({'foo': 'bar'}))
     def test_describe_repo(self, _):
         with self.assertRaises(ValueError):
             xrpc_repo.describe_repo({}, repo='unknown')
@@ -59,7 +59,7 @@ class XrpcRepoTest(testutil.XrpcTestCase):
             'handleIsCorrect': True,
         }, resp)
 
-    @patch('requests.get', return_value=testutil.requests_response('', status=500))
+    @patch('requests.Session.get', return_value=testutil.requests_response('', status=500))
     def test_describe_repo_did_doc_fetch_error(self, _):
         with self.assertRaises(ValueError) as e:
             resp = xrpc_repo.describe_repo({}, repo='did:web:user.com')
@@ -6,6 +6,7 @@ import time
 from unittest import skip
 from unittest.mock import patch
 
+from carbox import car
 from carbox.car import Block, read_car
 import dag_cbor
 from google.cloud import ndb
@@ -537,6 +538,7 @@ class SubscribeReposTest(testutil.XrpcTestCase):
     def setUp(self):
         super().setUp()
         self.repo.callback = lambda commit_data: xrpc_sync.send_events()
+        xrpc_sync._commit_car.cache.clear()
 
     def subscribe(self, received, delivered=None, limit=None, cursor=None):
         """subscribeRepos websocket client. May be run in a thread.
@@ -635,6 +637,30 @@ class SubscribeReposTest(testutil.XrpcTestCase):
         if record:
             self.assertIn(record, msg_records)
 
+    def test_commit_car(self, *_):
+        self.repo.apply_writes([Write(Action.CREATE, 'co.ll', next_tid(),
+                                      {'foo': 'bar'})])
+
+        for event in server.storage.read_events_by_seq():
+            if isinstance(event, dict):
+                continue
+            blocks = [Block(cid=block.cid, data=block.encoded)
+                      for block in event.blocks.values()]
+            self.assertEqual(
+                car.write_car([event.commit.cid], blocks),
+                xrpc_sync._commit_car(event))
+
+    def test_event_message_doesnt_modify_event(self, *_):
+        event = {
+            '$type': 'com.atproto.sync.subscribeRepos#identity',
+            'seq': 5,
+            'did': 'did:web:user.com',
+        }
+        self.assertEqual(
+            ({'op': 1, 't': '#identity'}, {'seq': 5, 'did': 'did:web:user.com'}),
+            xrpc_sync._event_message(event))
+        self.assertEqual('com.atproto.sync.subscribeRepos#identity', event['$type'])
+
     def test_subscribe_repos(self, *_):
         received_a = []
         delivered_a = Semaphore(value=0)
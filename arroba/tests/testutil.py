@@ -23,6 +23,7 @@ from multiformats import CID
 import requests
 
 from ..datastore_storage import DatastoreStorage
+from .. import repo
 from ..repo import Repo
 from .. import server
 from ..storage import MemoryStorage
@@ -116,6 +117,10 @@ class TestCase(unittest.TestCase):
         did.resolve_handle.cache.clear()
         did.resolve_plc.cache.clear()
         did.resolve_web.cache.clear()
+        did._plc_base.cache_clear()
+        did._pds_base.cache_clear()
+        did._plc_heads.clear()
+        repo._mst_get.cache.clear()
 
         os.environ.setdefault('PDS_HOST', 'localhost:8080')
         os.environ.setdefault('PLC_HOST', 'plc.bsky-sandbox.dev')
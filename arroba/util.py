@@ -293,9 +293,7 @@ def sign(obj, private_key):
     Returns:
       dict: ``obj`` with new ``sig`` field
     """
-    orig_sig = private_key.sign(dag_cbor.encode(obj), ec.ECDSA(hashes.SHA256()))
-    r, s = decode_dss_signature(apply_low_s_mitigation(orig_sig, private_key.curve))
-    obj['sig'] = r.to_bytes(32, 'big') + s.to_bytes(32, 'big')
+    obj['sig'] = sign_encoded(dag_cbor.encode(obj), private_key)
     return obj
 
     # old, using pycryptodome
@@ -304,6 +302,25 @@ def sign(obj, private_key):
     # return commit
 
 
+def sign_encoded(encoded, private_key):
+    """Signs already DAG-CBOR encoded bytes.
+
+    Lets callers that need the unsigned encoding themselves, eg
+    :func:`did.write_plc`, avoid encoding the same object twice. See
+    :func:`sign` for details.
+
+    Args:
+      encoded (bytes): DAG-CBOR encoded object
+      private_key (cryptography.hazmat.primitives.asymmetric.ec.EllipticCurvePrivateKey)
+
+    Returns:
+      bytes: 64-byte signature, ``r`` and ``s`` concatenated
+    """
+    orig_sig = private_key.sign(encoded, ec.ECDSA(hashes.SHA256()))
+    r, s = decode_dss_signature(apply_low_s_mitigation(orig_sig, private_key.curve))
+    return r.to_bytes(32, 'big') + s.to_bytes(32, 'big')
+
+
 def apply_low_s_mitigation(signature, curve):
     """Low-S signature mitigation.
 
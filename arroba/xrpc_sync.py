@@ -3,19 +3,20 @@ from datetime import timedelta, timezone
 import itertools
 import logging
 import os
-from threading import Condition
+from threading import Condition, Lock
 import time
 
+from cachetools import cached, LRUCache
 from carbox import car
 import dag_cbor
 from lexrpc.base import XrpcError
 from lexrpc.server import Redirect
-from multiformats import CID
+from multiformats import CID, varint
 from multiformats.multibase import MultibaseKeyError, MultibaseValueError
 
 from .datastore_storage import AtpBlock, AtpRemoteBlob, AtpRepo, DatastoreStorage
 from . import server
-from .storage import CommitData, SUBSCRIBE_REPOS_NSID
+from .storage import SUBSCRIBE_REPOS_NSID
 from . import util
 from . import xrpc_repo
 
@@ -23,10 +24,22 @@ logger = logging.getLogger(__name__)
 
 # used by subscribe_repos and send_events
 NEW_EVENTS_TIMEOUT = timedelta(seconds=20)
-new_events = Condition()
+new_events = Condition(Lock())
+# incremented by send_events. lets subscribe_repos tell whether it missed a
+# notification while it was busy reading events, instead of waiting for the next
+_new_events_count = 0
 
 GET_BLOB_CACHE_CONTROL = {'Cache-Control': 'public, max-age=3600'}  # 1 hour
 
+# number of commits to cache encoded CAR blocks for in subscribeRepos
+COMMIT_CAR_CACHE_SIZE = 2000
+
+# subscribeRepos message headers. shared across all messages, don't modify!
+COMMIT_HEADER = {'op': 1, 't': '#commit'}
+# maps full $type, eg com.atproto.sync.subscribeRepos#identity, to header.
+# populated on demand.
+_event_headers = {}
+
 
 @server.server.method('com.atproto.sync.getCheckout')
 def get_checkout(input, did=None):
@@ -95,8 +108,11 @@ def list_repos(input, limit=500, cursor=None):
 def send_events():
     """Triggers ``subscribeRepos`` to deliver new commits from storage to subscribers.
     """
+    global _new_events_count
+
     logger.debug(f'Triggering subscribeRepos to look for new commits')
     with new_events:
+        _new_events_count += 1
         new_events.notify_all()
 
 
@@ -125,6 +141,7 @@ def subscribe_repos(cursor=None):
     Returns:
       (dict, dict) tuple: (header, payload)
     """
+    seen_events_count = _new_events_count
     cur_seq = server.storage.last_seq(SUBSCRIBE_REPOS_NSID)
 
     def handle(event):
@@ -132,39 +149,10 @@ def subscribe_repos(cursor=None):
 
         if isinstance(event, dict):  # non-commit event
             cur_seq = event['seq']
-            type = event.pop('$type')
-            type_fragment = type.removeprefix('com.atproto.sync.subscribeRepos')
-            assert type_fragment != type, type
-            return ({'op': 1, 't': type_fragment}, event)
-
-        assert isinstance(event, CommitData), \
-            f'unexpected event type {event.__class__} {event}'
+            return _event_message(event)
 
         cur_seq = event.commit.seq
-        commit = event.commit.decoded
-        car_blocks = [car.Block(cid=block.cid, data=block.encoded,
-                                decoded=block.decoded)
-                      for block in event.blocks.values()]
-        return ({  # header
-            'op': 1,
-            't': '#commit',
-        }, {  # payload
-            'repo': commit['did'],
-            'ops': [{
-                'action': op.action.name.lower(),
-                'path': op.path,
-                'cid': op.cid,
-            } for op in (event.commit.ops or [])],
-            'commit': event.commit.cid,
-            'blocks': car.write_car([event.commit.cid], car_blocks),
-            'time': event.commit.time.replace(tzinfo=timezone.utc).isoformat(),
-            'seq': event.commit.seq,
-            'rev': util.int_to_tid(event.commit.seq, clock_id=0),
-            'since': None,  # TODO: load event.commit['prev']'s CID
-            'rebase': False,
-            'tooBig': False,
-            'blobs': [],
-        })
+        return _commit_message(event)
 
     if cursor is not None:
         assert cursor >= 0
@@ -196,8 +184,11 @@ def subscribe_repos(cursor=None):
 
     while True:
         with new_events:
-            new_events.wait(timeout_s)
+            new_events.wait_for(lambda: _new_events_count != seen_events_count,
+                                timeout_s)
+            seen_events_count = _new_events_count
 
+        last_query = time.time()
         for commit_data in server.storage.read_events_by_seq(start=cur_seq + 1):
             last_seq = cur_seq
             event = handle(commit_data)
@@ -215,9 +206,87 @@ def subscribe_repos(cursor=None):
                 break
 
         if delay := os.getenv('SUBSCRIBE_REPOS_BATCH_DELAY'):
-            time.sleep(float(delay))
+            time.sleep(max(float(delay) - (time.time() - last_query), 0))
+
+
+def _event_message(event):
+    """Converts a non-commit event from storage to a ``subscribeRepos`` message.
+
+    Args:
+      event (dict): with ``$type``. Not modified, since storage may return the
+        same dict to every reader.
+
+    Returns:
+      (dict, dict) tuple: (header, payload)
+    """
+    type = event['$type']
+    payload = {k: v for k, v in event.items() if k != '$type'}
+    if not (header := _event_headers.get(type)):
+        assert type.startswith(SUBSCRIBE_REPOS_NSID), type
+        header = _event_headers.setdefault(
+            type, {'op': 1, 't': type[len(SUBSCRIBE_REPOS_NSID):]})
+    return (header, payload)
 
 
+def _commit_message(commit_data):
+    """Converts a commit from storage to a ``subscribeRepos`` message.
+
+    Args:
+      commit_data (CommitData)
+
+    Returns:
+      (dict, dict) tuple: (header, payload)
+    """
+    commit = commit_data.commit
+    return (COMMIT_HEADER, {  # payload
+        'repo': commit.decoded['did'],
+        'ops': [{
+            'action': op.action.name.lower(),
+            'path': op.path,
+            'cid': op.cid,
+        } for op in (commit.ops or [])],
+        'commit': commit.cid,
+        'blocks': _commit_car(commit_data),
+        'time': commit.time.replace(tzinfo=timezone.utc).isoformat(),
+        'seq': commit.seq,
+        # commits' revs are their seqs, so we don't need to re-encode them
+        'rev': commit.decoded['rev'],
+        'since': None,  # TODO: load commit['prev']'s CID
+        'rebase': False,
+        'tooBig': False,
+        'blobs': [],
+    })
+
+
+@cached(LRUCache(maxsize=COMMIT_CAR_CACHE_SIZE),
+        key=lambda commit_data: commit_data.commit.cid, lock=Lock())
+def _commit_car(commit_data):
+    """Encodes a commit's blocks into a CAR for a ``subscribeRepos`` message.
+
+    Cached by commit CID so that subscribers reading the same commits, eg
+    when they connect with a cursor, don't each re-encode them.
+
+    Args:
+      commit_data (CommitData)
+
+    Returns:
+      bytes: CAR file
+    """
+    # we already have every block's CID and encoding, so write the CAR directly
+    # into one buffer instead of building car.Blocks for car.write_car.
+    # https://ipld.io/specs/transport/car/carv1/#format-description
+    header = dag_cbor.encode({'version': 1, 'roots': [commit_data.commit.cid]})
+    out = bytearray(varint.encode(len(header)))
+    out += header
+
+    for block in commit_data.blocks.values():
+        cid = bytes(block.cid)
+        out += varint.encode(len(cid) + len(block.encoded))
+        out += cid
+        out += block.encoded
+
+    return bytes(out)
+
 
 @server.server.method('com.atproto.sync.getBlocks')
 def get_blocks(input, did=None, cids=()):